@@ -0,0 +1,419 @@
+"""
+Packed offline extraction of ID documents
+
+For backlog re-processing, one model round trip per image means the per-request
+overhead dominates. This module groups several rectified document images into a
+single prompt, maps the returned array back to each input and re-queues every
+document whose record does not pass validate_id_data.
+
+Usage:
+    python batch_extraction.py captures/*.jpg --batch-size 8 --output results.jsonl
+    python batch_extraction.py --fake 200 --fake-latency 2.0 --compare
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from id_extraction import encode_document, extraction_request, parse_extraction_response
+from json_utils import extract_json_from_text, format_json_for_display, validate_id_data
+
+MODEL_NAME = "gemini-2.5-pro-exp-03-25"
+
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_MAX_BATCH_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Price in USD per million tokens, used for the cost per document estimate
+DEFAULT_INPUT_PRICE = 1.25
+DEFAULT_OUTPUT_PRICE = 10.0
+
+PACKED_PROMPT = """
+        You are given {count} separate ID document images, each preceded by its label "Document N".
+        Extract all information from every document independently.
+        Return the data in the following JSON format, with exactly one entry per document:
+        {{
+            "documents": [
+                {{
+                    "index": N,
+                    "document_type": "ID Card/Passport/Driver's License",
+                    "id_number": "",
+                    "full_name": "",
+                    "date_of_birth": "",
+                    "date_of_issue": "",
+                    "date_of_expiry": "",
+                    "nationality": "",
+                    "gender": "",
+                    "additional_info": {{}}
+                }}
+            ]
+        }}
+        "index" must be the N of the "Document N" label the entry belongs to.
+        If any field is not visible or cannot be determined, leave it as an empty string.
+        For additional_info, include any other fields present on the document.
+        """
+
+
+def check_limits(**limits):
+    """
+    Check that batching limits are at least 1
+
+    Args:
+        **limits: Limit name -> value, e.g. batch_size=8
+
+    Raises:
+        ValueError: If a limit is smaller than 1
+    """
+    for name, value in limits.items():
+        if value < 1:
+            raise ValueError(f"{name} must be at least 1, got {value}")
+
+
+def take_batch(queue, encoded, batch_size, max_batch_bytes):
+    """
+    Pop the next batch of documents from the queue
+
+    A document that is larger than the byte budget on its own is sent alone.
+
+    Args:
+        queue: deque of (index, attempts) tuples
+        encoded: List of JPEG bytes, one per input document
+        batch_size: Maximum number of documents per call
+        max_batch_bytes: Maximum total image bytes per call
+
+    Returns:
+        batch: List of (index, attempts) tuples
+    """
+    batch = []
+    total_bytes = 0
+
+    while queue and len(batch) < batch_size:
+        index, attempts = queue[0]
+        size = len(encoded[index])
+        if batch and total_bytes + size > max_batch_bytes:
+            break
+        queue.popleft()
+        batch.append((index, attempts))
+        total_bytes += size
+
+    return batch
+
+
+def parse_packed_response(text, count):
+    """
+    Map a packed model response back to the documents of the batch
+
+    Entries are matched by their "index" field; entries without one fall back to
+    their position in the returned array.
+
+    Args:
+        text: Response text from the model
+        count: Number of documents in the batch
+
+    Returns:
+        records: Dict of batch position -> JSON string of the record
+    """
+    data, _ = extract_json_from_text(text)
+
+    if isinstance(data, dict):
+        entries = data.get("documents")
+    else:
+        entries = data
+
+    if not isinstance(entries, list):
+        return {}
+
+    records = {}
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            continue
+        index = entry.pop("index", position)
+        try:
+            index = int(index)
+        except (TypeError, ValueError):
+            index = position
+        if 0 <= index < count and index not in records:
+            records[index] = json.dumps(entry)
+
+    return records
+
+
+def _usage_tokens(response):
+    """Return (input, output) token counts from a response, if reported"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0, 0
+    return (getattr(usage, "prompt_token_count", 0) or 0,
+            getattr(usage, "candidates_token_count", 0) or 0)
+
+
+def _new_stats(mode, count):
+    return {
+        "mode": mode,
+        "documents": count,
+        "succeeded": 0,
+        "failed": 0,
+        "calls": 0,
+        "requeued": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "elapsed": 0.0
+    }
+
+
+def _finish_stats(stats, input_price, output_price):
+    """Add throughput and cost figures to the stats"""
+    elapsed = stats["elapsed"]
+    cost = (stats["input_tokens"] * input_price + stats["output_tokens"] * output_price) / 1_000_000
+    stats["docs_per_second"] = stats["documents"] / elapsed if elapsed > 0 else 0.0
+    stats["cost"] = cost
+    stats["cost_per_document"] = cost / stats["documents"] if stats["documents"] else 0.0
+    return stats
+
+
+def extract_packed(model, images, batch_size=DEFAULT_BATCH_SIZE, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES,
+                   max_attempts=DEFAULT_MAX_ATTEMPTS, input_price=DEFAULT_INPUT_PRICE,
+                   output_price=DEFAULT_OUTPUT_PRICE):
+    """
+    Extract data from many ID documents, several documents per model call
+
+    Args:
+        model: Gemini model (or FakeGeminiModel)
+        images: List of rectified document images (numpy arrays)
+        batch_size: Maximum number of documents per call
+        max_batch_bytes: Maximum total image bytes per call
+        max_attempts: Number of times a document is sent before it is reported as failed
+        input_price: USD per million input tokens
+        output_price: USD per million output tokens
+
+    Returns:
+        results: List of (success, data) tuples in input order, as returned by process_id_document
+        stats: Dict with call counts, throughput and cost figures
+    """
+    check_limits(batch_size=batch_size, max_batch_bytes=max_batch_bytes, max_attempts=max_attempts)
+
+    encoded = [encode_document(image) for image in images]
+    results = [None] * len(images)
+    stats = _new_stats("packed", len(images))
+    queue = deque((index, 0) for index in range(len(images)))
+
+    start = time.perf_counter()
+    while queue:
+        batch = take_batch(queue, encoded, batch_size, max_batch_bytes)
+
+        contents = [PACKED_PROMPT.format(count=len(batch))]
+        for position, (index, _) in enumerate(batch):
+            contents.append(f"Document {position}:")
+            contents.append({"mime_type": "image/jpeg", "data": encoded[index]})
+
+        try:
+            response = model.generate_content(contents)
+            stats["calls"] += 1
+            input_tokens, output_tokens = _usage_tokens(response)
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            records = parse_packed_response(response.text, len(batch))
+            error = "Invalid ID data: No record returned for this document"
+        except Exception as e:
+            stats["calls"] += 1
+            records = {}
+            error = str(e)
+
+        for position, (index, attempts) in enumerate(batch):
+            json_str = records.get(position)
+            if json_str is not None:
+                is_valid, message = validate_id_data(json_str)
+                message = f"Invalid ID data: {message}"
+            else:
+                is_valid, message = False, error
+
+            if is_valid:
+                results[index] = (True, format_json_for_display(json_str))
+                stats["succeeded"] += 1
+            elif attempts + 1 < max_attempts:
+                queue.append((index, attempts + 1))
+                stats["requeued"] += 1
+            else:
+                results[index] = (False, message)
+                stats["failed"] += 1
+
+    stats["elapsed"] = time.perf_counter() - start
+    return results, _finish_stats(stats, input_price, output_price)
+
+
+def extract_single(model, images, max_attempts=DEFAULT_MAX_ATTEMPTS, input_price=DEFAULT_INPUT_PRICE,
+                   output_price=DEFAULT_OUTPUT_PRICE):
+    """
+    Extract data from many ID documents, one document per model call
+
+    This is the same request the application makes in process_id_document (see
+    id_extraction.py) and is the baseline the packed mode is measured against.
+
+    Args:
+        model: Gemini model (or FakeGeminiModel)
+        images: List of rectified document images (numpy arrays)
+        max_attempts: Number of times a document is sent before it is reported as failed
+        input_price: USD per million input tokens
+        output_price: USD per million output tokens
+
+    Returns:
+        results: List of (success, data) tuples in input order
+        stats: Dict with call counts, throughput and cost figures
+    """
+    check_limits(max_attempts=max_attempts)
+
+    results = []
+    stats = _new_stats("single", len(images))
+
+    start = time.perf_counter()
+    for image in images:
+        contents = extraction_request(encode_document(image))
+        for attempt in range(max_attempts):
+            try:
+                response = model.generate_content(contents)
+                stats["calls"] += 1
+                input_tokens, output_tokens = _usage_tokens(response)
+                stats["input_tokens"] += input_tokens
+                stats["output_tokens"] += output_tokens
+                success, data = parse_extraction_response(response.text)
+            except Exception as e:
+                stats["calls"] += 1
+                success, data = False, str(e)
+
+            if success:
+                stats["succeeded"] += 1
+                break
+            if attempt + 1 < max_attempts:
+                stats["requeued"] += 1
+        else:
+            stats["failed"] += 1
+        results.append((success, data))
+
+    stats["elapsed"] = time.perf_counter() - start
+    return results, _finish_stats(stats, input_price, output_price)
+
+
+def format_report(stats_list):
+    """
+    Format extraction stats as a plain text table
+
+    Args:
+        stats_list: List of stats dicts from extract_packed/extract_single
+
+    Returns:
+        report: Table as a string
+    """
+    header = f"{'mode':<8} {'docs':>6} {'ok':>6} {'failed':>6} {'calls':>6} {'requeued':>8} " \
+             f"{'docs/s':>8} {'USD/doc':>10}"
+    lines = [header, "-" * len(header)]
+    for stats in stats_list:
+        lines.append(
+            f"{stats['mode']:<8} {stats['documents']:>6} {stats['succeeded']:>6} {stats['failed']:>6} "
+            f"{stats['calls']:>6} {stats['requeued']:>8} {stats['docs_per_second']:>8.2f} "
+            f"{stats['cost_per_document']:>10.6f}"
+        )
+
+    if len(stats_list) == 2 and stats_list[1]["docs_per_second"] > 0 and stats_list[1]["cost_per_document"] > 0:
+        packed, single = stats_list
+        lines.append("")
+        lines.append(f"Speed-up: {packed['docs_per_second'] / single['docs_per_second']:.2f}x, "
+                     f"cost ratio: {packed['cost_per_document'] / single['cost_per_document']:.2f}")
+
+    return "\n".join(lines)
+
+
+def synthetic_documents(count, seed=0):
+    """
+    Generate distinct card-like images for exercising the pipeline offline
+
+    Args:
+        count: Number of images
+        seed: Random seed
+
+    Returns:
+        images: List of BGR images (numpy arrays)
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        image = np.empty((340, 540, 3), dtype=np.uint8)
+        image[:] = rng.integers(180, 255, size=3, dtype=np.uint8)
+        cv2.rectangle(image, (30, 60), (160, 220), (120, 120, 120), -1)
+        cv2.putText(image, f"ID {i:08d}", (190, 110), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (20, 20, 20), 2)
+        cv2.putText(image, "TEST DOCUMENT", (190, 170), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2)
+        images.append(image)
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packed offline extraction of ID documents")
+    parser.add_argument("images", nargs="*", help="Rectified document images")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--max-batch-kb", type=int, default=DEFAULT_MAX_BATCH_BYTES // 1024)
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    parser.add_argument("--input-price", type=float, default=DEFAULT_INPUT_PRICE,
+                        help="USD per million input tokens")
+    parser.add_argument("--output-price", type=float, default=DEFAULT_OUTPUT_PRICE,
+                        help="USD per million output tokens")
+    parser.add_argument("--compare", action="store_true",
+                        help="Also run the one-document-per-call path and compare")
+    parser.add_argument("--output", help="Write one JSON line per document to this file")
+    parser.add_argument("--fake", type=int, default=0,
+                        help="Use the local fake model on this many synthetic documents")
+    parser.add_argument("--fake-latency", type=float, default=1.0)
+    parser.add_argument("--fake-per-image-latency", type=float, default=0.1)
+    parser.add_argument("--fake-failure-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for option in ("batch_size", "max_batch_kb", "max_attempts"):
+        if getattr(args, option) < 1:
+            parser.error(f"--{option.replace('_', '-')} must be at least 1")
+
+    if args.fake:
+        from fake_model import FakeGeminiModel
+        model = FakeGeminiModel(latency=args.fake_latency, per_image_latency=args.fake_per_image_latency,
+                                failure_rate=args.fake_failure_rate)
+        images = synthetic_documents(args.fake)
+        paths = [f"synthetic-{i}" for i in range(args.fake)]
+    else:
+        import google.generativeai as genai
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            parser.error("Set GEMINI_API_KEY or use --fake")
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(MODEL_NAME)
+        paths = args.images
+        images = [cv2.imread(path) for path in paths]
+        unreadable = [path for path, image in zip(paths, images) if image is None]
+        if unreadable:
+            parser.error(f"Could not read: {', '.join(unreadable)}")
+
+    if not images:
+        parser.error("No images given")
+
+    results, packed_stats = extract_packed(model, images, batch_size=args.batch_size,
+                                           max_batch_bytes=args.max_batch_kb * 1024,
+                                           max_attempts=args.max_attempts,
+                                           input_price=args.input_price, output_price=args.output_price)
+    stats_list = [packed_stats]
+
+    if args.compare:
+        _, single_stats = extract_single(model, images, max_attempts=args.max_attempts,
+                                         input_price=args.input_price, output_price=args.output_price)
+        stats_list.append(single_stats)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            for path, (success, data) in zip(paths, results):
+                f.write(json.dumps({"image": path, "success": success, "data": data}) + "\n")
+
+    print(format_report(stats_list))
+
+
+if __name__ == "__main__":
+    main()
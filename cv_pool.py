@@ -0,0 +1,569 @@
+"""
+Shared CPU worker pool for the OpenCV stages
+
+Streamlit runs every session's script in a thread of one process, so document
+detection, extraction and face detection from all sessions compete for the same
+interpreter. This pool runs them in dedicated worker processes instead. Frames
+travel through shared memory blocks that are reused between tasks; only the task
+description and small results (flags, corner coordinates, face boxes) are
+pickled. Submission is bounded and every task carries a deadline.
+
+Usage:
+    python cv_pool.py --max-workers 8 --clients 16 --frames 400
+"""
+
+import argparse
+import atexit
+import itertools
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import get_context, shared_memory
+from multiprocessing.connection import wait
+
+import cv2
+import numpy as np
+
+from document_detection import DEFAULT_PROFILE, DetectorProfile, detect_document, extract_document
+from face_detection import detect_faces, load_face_cascade
+
+DEFAULT_TIMEOUT = 2.0
+
+# Time a task may wait for a worker to finish starting before its own deadline begins
+STARTUP_TIMEOUT = 30.0
+
+# Longest delay before restarting a worker that keeps exiting before it is ready
+MAX_RESTART_DELAY = 30.0
+
+# Shared memory attachments a worker keeps open for reuse
+WORKER_ATTACH_CACHE = 32
+
+# Serialises the __main__ swap in _start_process between pools and restart timers
+_spawn_lock = threading.Lock()
+
+
+class PoolBusy(RuntimeError):
+    """Raised when the pool already has its maximum number of pending tasks"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a task did not complete before its deadline"""
+
+
+class WorkerError(RuntimeError):
+    """Raised when a task failed in a worker or its worker exited while running it"""
+
+
+def _worker_main(tasks, results, profile):
+    """Worker process loop: run OpenCV tasks on frames held in shared memory"""
+    # The pool provides the parallelism; avoid oversubscribing cores
+    cv2.setNumThreads(1)
+    profile = DetectorProfile.from_dict(profile)
+    cascade = load_face_cascade()
+    attached = {}
+    results.send((None, "ready", None))
+
+    while True:
+        try:
+            task = tasks.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        task_id, op, block_name, shape, dtype, deadline, params = task
+        if time.time() > deadline:
+            results.send((task_id, "expired", None))
+            continue
+
+        shm = attached.pop(block_name, None)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=block_name)
+        attached[block_name] = shm
+        if len(attached) > WORKER_ATTACH_CACHE:
+            oldest = next(iter(attached))
+            attached.pop(oldest).close()
+
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        output = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=nbytes)
+
+        try:
+            started = time.perf_counter()
+            result = {}
+
+            if op in ("detect", "detect_extract"):
+                processed_frame, detected, coords = detect_document(frame, profile)
+                output[:] = processed_frame
+                result["detected"] = detected
+                result["coords"] = coords
+                result["document"] = None
+                if op == "detect_extract" and detected:
+                    document = extract_document(frame, coords)
+                    if document is not None:
+                        result["document"] = _export(document)
+
+            elif op == "faces":
+                result["faces"] = detect_faces(frame, cascade, **params)
+
+            else:
+                raise ValueError(f"Unknown operation: {op}")
+
+            result["elapsed"] = time.perf_counter() - started
+            results.send((task_id, "ok", result))
+
+        except Exception as e:
+            results.send((task_id, "error", repr(e)))
+
+        finally:
+            # Views must be released before the block can be closed later
+            del frame, output
+
+    for shm in attached.values():
+        shm.close()
+
+
+def _export(array):
+    """Copy an array produced in a worker into a new shared memory block"""
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    ref = (shm.name, array.shape, array.dtype.str)
+    shm.close()
+    return ref
+
+
+def _import(ref):
+    """Copy an exported array out of shared memory and free the block"""
+    name, shape, dtype = ref
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array = view.copy()
+        del view
+    finally:
+        shm.close()
+        shm.unlink()
+    return array
+
+
+def _start_process(process):
+    """
+    Start a spawned process without re-running the parent's __main__ module
+
+    spawn imports the parent's __main__ in the child. Under Streamlit that is the
+    app script, which would configure the model and build the page in every
+    worker, and start a pool of its own if it created one at import time. The
+    worker only needs this module, so __main__ is replaced by an empty module
+    while the process starts. When this module itself is __main__ (the
+    benchmark), it is left in place because the worker function lives there.
+    """
+    if _worker_main.__module__ == "__main__":
+        process.start()
+        return
+
+    with _spawn_lock:
+        main = sys.modules.get("__main__")
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            process.start()
+        finally:
+            sys.modules["__main__"] = main
+
+
+class _Worker:
+    """A worker process with its own task and result pipes"""
+
+    def __init__(self, context, profile):
+        task_reader, self.tasks = context.Pipe(duplex=False)
+        self.results, result_writer = context.Pipe(duplex=False)
+        self.process = context.Process(target=_worker_main, args=(task_reader, result_writer, profile),
+                                       daemon=True)
+        _start_process(self.process)
+        # The child holds its own copies of these ends
+        task_reader.close()
+        result_writer.close()
+        self.ready = False
+        self.in_flight = set()
+
+    def close(self):
+        self.tasks.close()
+        self.results.close()
+
+
+class CvWorkerPool:
+    """
+    Process pool for detect_document, extract_document and face detection
+
+    Safe to share between Streamlit sessions (threads). Each call blocks until
+    its result is available or its deadline passes. A worker that exits is
+    replaced; the tasks it was running fail with WorkerError.
+
+    Args:
+        workers: Number of worker processes (defaults to the number of CPU cores)
+        max_pending: Maximum number of submitted but unfinished tasks
+        timeout: Default per-task deadline in seconds
+        profile: DetectorProfile used for document detection
+    """
+
+    def __init__(self, workers=None, max_pending=None, timeout=DEFAULT_TIMEOUT, profile=DEFAULT_PROFILE):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.timeout = timeout
+        self.restarts = 0
+
+        # spawn avoids forking a process that already runs Streamlit threads
+        self._context = get_context("spawn")
+        self._profile = profile.to_dict()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._pending = {}
+        self._free_blocks = {}
+        self._task_ids = itertools.count()
+        self._closed = False
+        self._failed_starts = 0
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+
+        self._workers = [_Worker(self._context, self._profile) for _ in range(self.workers)]
+
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+        atexit.register(self.close)
+
+    def detect_document(self, frame, timeout=None):
+        """
+        Run detect_document in a worker
+
+        Returns:
+            processed_frame, document_detected, document_coords as detect_document does
+        """
+        result = self._run("detect", frame, timeout)
+        return result["processed_frame"], result["detected"], result["coords"]
+
+    def detect_and_extract(self, frame, timeout=None):
+        """
+        Run detect_document and, if a document is found, extract_document in a worker
+
+        Returns:
+            processed_frame: Frame with detected document highlighted
+            document_detected: Boolean indicating if document was detected
+            document_coords: Coordinates of the document if detected, None otherwise
+            document: Rectified document image if detected, None otherwise
+        """
+        result = self._run("detect_extract", frame, timeout)
+        return result["processed_frame"], result["detected"], result["coords"], result["document"]
+
+    def detect_faces(self, frame, timeout=None, **params):
+        """
+        Run face detection in a worker
+
+        Returns:
+            faces: List of (x, y, w, h) tuples
+        """
+        return self._run("faces", frame, timeout, params)["faces"]
+
+    def close(self):
+        """Stop the workers and free all shared memory"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+            self._ready.notify_all()
+
+        for worker in workers:
+            try:
+                worker.tasks.send(None)
+            except OSError:
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+
+        self._wake()
+        self._dispatcher.join(timeout=5)
+
+        with self._lock:
+            for blocks in self._free_blocks.values():
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+            self._free_blocks.clear()
+
+    def _run(self, op, frame, timeout, params=None):
+        """Submit a task and wait for its result"""
+        if self._closed:
+            raise RuntimeError("Pool is closed")
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy(f"{self.max_pending} tasks already pending")
+
+        task = {"slot": True}
+        try:
+            timeout = self.timeout if timeout is None else timeout
+            frame = np.ascontiguousarray(frame)
+
+            # Input frame followed by room for the processed frame
+            block = self._acquire_block(2 * frame.nbytes)
+            np.ndarray(frame.shape, dtype=frame.dtype, buffer=block.buf)[:] = frame
+            task.update(future=Future(), block=block, shape=frame.shape, dtype=frame.dtype)
+
+            with self._lock:
+                worker = self._ready_worker()
+                if worker is None:
+                    self._release_block(block, locked=True)
+                    raise DeadlineExceeded(f"No worker became ready within {STARTUP_TIMEOUT:.0f} s")
+
+                # The deadline starts once a worker is available, not during its start-up
+                deadline = time.time() + timeout
+                task_id = next(self._task_ids)
+                task["worker"] = worker
+                self._pending[task_id] = task
+                worker.in_flight.add(task_id)
+                try:
+                    worker.tasks.send((task_id, op, block.name, frame.shape, frame.dtype.str, deadline,
+                                       params or {}))
+                except OSError:
+                    # The worker has exited; the dispatcher fails its tasks
+                    pass
+
+            try:
+                return task["future"].result(timeout=max(deadline - time.time(), 0))
+            except FutureTimeout:
+                raise DeadlineExceeded(f"{op} did not finish within {timeout:.1f} s") from None
+        finally:
+            # Free the slot at the deadline even if a hung worker never answers
+            self._release_slot(task)
+
+    def _ready_worker(self):
+        """Return the ready worker with the fewest tasks, waiting for one to start if needed (lock held)"""
+        give_up = time.time() + STARTUP_TIMEOUT
+        while not self._closed:
+            ready = [worker for worker in self._workers if worker.ready]
+            if ready:
+                return min(ready, key=lambda worker: len(worker.in_flight))
+            remaining = give_up - time.time()
+            if remaining <= 0:
+                break
+            self._ready.wait(remaining)
+        return None
+
+    def _release_slot(self, task):
+        with self._lock:
+            held = task.pop("slot", False)
+        if held:
+            self._slots.release()
+
+    def _wake(self):
+        """Make the dispatcher re-read the worker list"""
+        try:
+            self._wakeup_writer.send(None)
+        except OSError:
+            pass
+
+    def _dispatch(self):
+        """Collect worker results, copy outputs out of shared memory and replace exited workers"""
+        while True:
+            with self._lock:
+                workers = list(self._workers)
+                if self._closed and not workers:
+                    break
+
+            sources = {self._wakeup_reader: None}
+            for worker in workers:
+                sources[worker.results] = worker
+                sources[worker.process.sentinel] = worker
+
+            ready = wait(list(sources))
+            # Read results before handling exits so a worker's last answers are not lost
+            ready.sort(key=lambda source: not hasattr(source, "recv"))
+
+            for source in ready:
+                worker = sources[source]
+                if worker is None:
+                    self._wakeup_reader.recv()
+                elif source is worker.results:
+                    try:
+                        self._handle(worker, *worker.results.recv())
+                    except (EOFError, OSError):
+                        pass
+                elif worker in self._workers:
+                    self._handle_exit(worker)
+
+    def _handle(self, worker, task_id, status, payload):
+        """Resolve the future of a finished task"""
+        if status == "ready":
+            with self._lock:
+                worker.ready = True
+                self._failed_starts = 0
+                self._ready.notify_all()
+            return
+
+        with self._lock:
+            worker.in_flight.discard(task_id)
+            task = self._pending.pop(task_id, None)
+        if task is None:
+            return
+        future, block, shape, dtype = task["future"], task["block"], task["shape"], task["dtype"]
+
+        try:
+            if status == "ok":
+                if "detected" in payload:
+                    nbytes = int(np.prod(shape)) * dtype.itemsize
+                    view = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=nbytes)
+                    payload["processed_frame"] = view.copy()
+                    del view
+                if payload.get("document") is not None:
+                    payload["document"] = _import(payload["document"])
+                if not future.done():
+                    future.set_result(payload)
+            elif status == "expired":
+                if not future.done():
+                    future.set_exception(DeadlineExceeded("Task expired before a worker was free"))
+            elif not future.done():
+                future.set_exception(WorkerError(payload))
+        finally:
+            self._release_block(block)
+            self._release_slot(task)
+
+    def _handle_exit(self, worker):
+        """Fail the tasks of an exited worker and start a replacement"""
+        try:
+            while worker.results.poll():
+                self._handle(worker, *worker.results.recv())
+        except (EOFError, OSError):
+            pass
+
+        with self._lock:
+            self._workers.remove(worker)
+            tasks = [self._pending.pop(task_id) for task_id in worker.in_flight if task_id in self._pending]
+            restart = not self._closed
+            if not worker.ready:
+                self._failed_starts += 1
+            delay = min(2 ** self._failed_starts - 1, MAX_RESTART_DELAY) if self._failed_starts else 0
+
+        worker.close()
+        error = WorkerError(f"Worker exited with code {worker.process.exitcode}")
+        for task in tasks:
+            if not task["future"].done():
+                task["future"].set_exception(error)
+            self._release_block(task["block"])
+            self._release_slot(task)
+
+        if restart:
+            # Back off when workers exit before becoming ready, e.g. on a bad profile
+            timer = threading.Timer(delay, self._start_worker)
+            timer.daemon = True
+            timer.start()
+
+    def _start_worker(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._workers.append(_Worker(self._context, self._profile))
+            self.restarts += 1
+        self._wake()
+
+    def _acquire_block(self, size):
+        with self._lock:
+            blocks = self._free_blocks.get(size)
+            if blocks:
+                return blocks.pop()
+        return shared_memory.SharedMemory(create=True, size=size)
+
+    def _release_block(self, block, locked=False):
+        size = block.size
+        if not locked:
+            self._lock.acquire()
+        try:
+            blocks = self._free_blocks.setdefault(size, [])
+            if not self._closed and len(blocks) < self.max_pending:
+                blocks.append(block)
+                return
+        finally:
+            if not locked:
+                self._lock.release()
+        block.close()
+        block.unlink()
+
+
+def synthetic_frame(seed=0, size=(720, 1280)):
+    """Return a camera-sized frame containing a card-like quadrilateral"""
+    rng = np.random.default_rng(seed)
+    h, w = size
+    frame = rng.integers(20, 90, size=(h, w, 3), dtype=np.uint8)
+    corners = np.array([[0.25, 0.25], [0.75, 0.27], [0.76, 0.72], [0.24, 0.70]]) * [w, h]
+    corners += rng.integers(-15, 15, size=(4, 2))
+    cv2.fillPoly(frame, [corners.astype(np.int32)], (225, 225, 220))
+    return frame
+
+
+def measure_throughput(run, frames, clients):
+    """
+    Measure frames per second with several client threads calling run(frame)
+
+    Returns:
+        fps: Completed frames per second
+    """
+    index = itertools.count()
+
+    def client():
+        while True:
+            i = next(index)
+            if i >= len(frames):
+                return
+            while True:
+                try:
+                    run(frames[i])
+                    break
+                except PoolBusy:
+                    time.sleep(0.001)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(frames) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling curve of the OpenCV worker pool")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent client threads (sessions)")
+    parser.add_argument("--frames", type=int, default=200, help="Frames per measurement")
+    args = parser.parse_args()
+
+    frames = [synthetic_frame(i % 8) for i in range(args.frames)]
+
+    def inline(frame):
+        processed_frame, detected, coords = detect_document(frame)
+        if detected:
+            extract_document(frame, coords)
+
+    baseline = measure_throughput(inline, frames, args.clients)
+    print(f"{args.clients} client threads, {args.frames} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"{'workers':>8} {'frames/s':>10} {'speed-up':>9}")
+    print(f"{'inline':>8} {baseline:>10.1f} {1.0:>9.2f}")
+
+    for workers in range(1, args.max_workers + 1):
+        pool = CvWorkerPool(workers=workers, timeout=30)
+        try:
+            # Warm up the workers before measuring
+            measure_throughput(pool.detect_and_extract, frames[:workers * 2], workers)
+            fps = measure_throughput(pool.detect_and_extract, frames, args.clients)
+        finally:
+            pool.close()
+        print(f"{workers:>8} {fps:>10.1f} {fps / baseline:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,218 @@
+import json
+from dataclasses import dataclass, asdict, fields
+
 import cv2
 import numpy as np
 
-def detect_document(frame):
+# Edge strategies available to the detection cascade; "canny" is always tried first
+STRATEGIES = ("canny", "morph_close", "adaptive")
+
+@dataclass
+class DetectorProfile:
     """
-    Detect ID document in a frame and return the document contour
+    Parameters of detect_document
+    
+    Attributes:
+        blur_kernel: Size of the Gaussian blur kernel (odd)
+        canny_low: Lower Canny hysteresis threshold
+        canny_high: Upper Canny hysteresis threshold
+        max_contours: Number of largest contours checked for a document
+        epsilon_ratio: approxPolyDP epsilon as a fraction of the contour perimeter
+        min_area_ratio: Minimum document area as a fraction of the frame
+        max_area_ratio: Maximum document area as a fraction of the frame
+        fallbacks: Strategies tried in order only when the Canny pass finds nothing (none by default)
+        close_kernel: Kernel size of the morphological close ("morph_close")
+        adaptive_block_size: Neighbourhood size of the adaptive threshold ("adaptive", odd)
+        adaptive_c: Constant subtracted by the adaptive threshold ("adaptive")
+    """
+    blur_kernel: int = 5
+    canny_low: int = 75
+    canny_high: int = 200
+    max_contours: int = 5
+    epsilon_ratio: float = 0.02
+    min_area_ratio: float = 0.05
+    max_area_ratio: float = 0.9
+    fallbacks: tuple = ()
+    close_kernel: int = 7
+    adaptive_block_size: int = 21
+    adaptive_c: int = 10
+    
+    def __post_init__(self):
+        self.fallbacks = tuple(self.fallbacks)
+        problems = self.problems()
+        if problems:
+            raise ValueError("Invalid detector profile: " + "; ".join(problems))
+    
+    def problems(self):
+        """Return a list of messages for parameter values OpenCV would reject or that never detect anything"""
+        problems = []
+        for name, minimum in (("blur_kernel", 1), ("adaptive_block_size", 3)):
+            value = getattr(self, name)
+            if not _is_int(value) or value < minimum or value % 2 == 0:
+                problems.append(f"{name} must be an odd integer of at least {minimum}, got {value!r}")
+        for name in ("canny_low", "canny_high", "max_contours", "close_kernel", "adaptive_c"):
+            if not _is_int(getattr(self, name)):
+                problems.append(f"{name} must be an integer, got {getattr(self, name)!r}")
+        if _is_int(self.canny_low) and _is_int(self.canny_high) and not 0 <= self.canny_low < self.canny_high:
+            problems.append(f"canny_low must be at least 0 and below canny_high, got {self.canny_low} and "
+                            f"{self.canny_high}")
+        if _is_int(self.max_contours) and self.max_contours < 1:
+            problems.append(f"max_contours must be at least 1, got {self.max_contours}")
+        if _is_int(self.close_kernel) and self.close_kernel < 1:
+            problems.append(f"close_kernel must be at least 1, got {self.close_kernel}")
+        if not isinstance(self.epsilon_ratio, (int, float)) or not 0 < self.epsilon_ratio < 1:
+            problems.append(f"epsilon_ratio must be between 0 and 1, got {self.epsilon_ratio!r}")
+        if not all(isinstance(v, (int, float)) for v in (self.min_area_ratio, self.max_area_ratio)) or \
+                not 0 <= self.min_area_ratio < self.max_area_ratio <= 1:
+            problems.append(f"min_area_ratio and max_area_ratio must satisfy 0 <= min < max <= 1, got "
+                            f"{self.min_area_ratio!r} and {self.max_area_ratio!r}")
+        for strategy in self.fallbacks:
+            if strategy not in STRATEGIES[1:]:
+                problems.append(f"unknown fallback {strategy!r}, expected one of {', '.join(STRATEGIES[1:])}")
+        return problems
+    
+    def to_dict(self):
+        """Return the profile as a JSON-serialisable dict"""
+        data = asdict(self)
+        data["fallbacks"] = list(self.fallbacks)
+        return data
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Create a profile from a dict, ignoring unknown keys"""
+        known = {f.name for f in fields(cls)}
+        values = {key: value for key, value in data.items() if key in known}
+        return cls(**values)
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+DEFAULT_PROFILE = DetectorProfile()
+
+def load_profile(path):
+    """
+    Load a detector profile from a JSON file
     
     Args:
-        frame: Camera frame (numpy array)
+        path: Path to a JSON file written by tune_detector.py or by hand
         
     Returns:
-        processed_frame: Frame with detected document highlighted
-        document_detected: Boolean indicating if document was detected
-        document_coords: Coordinates of the document if detected, None otherwise
+        profile: DetectorProfile
+        
+    Raises:
+        ValueError: If the file is not valid JSON or the profile is invalid
     """
-    # Make a copy of the frame to avoid modifying the original
-    processed_frame = frame.copy()
-    
-    # Convert to grayscale
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    with open(path, "r") as f:
+        try:
+            return DetectorProfile.from_dict(json.load(f))
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from None
+
+def _edge_map(blurred, strategy, profile):
+    """Binary edge image for one strategy of the cascade"""
+    if strategy == "canny":
+        return cv2.Canny(blurred, profile.canny_low, profile.canny_high)
     
-    # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    if strategy == "morph_close":
+        # Bridge gaps in the edges, e.g. where glare breaks the card border
+        edges = cv2.Canny(blurred, profile.canny_low // 2, profile.canny_high // 2)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (profile.close_kernel, profile.close_kernel))
+        return cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
     
-    # Apply edge detection
-    edges = cv2.Canny(blurred, 75, 200)
+    if strategy == "adaptive":
+        # Local thresholding copes with low contrast and uneven lighting
+        return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV,
+                                     profile.adaptive_block_size, profile.adaptive_c)
     
+    raise ValueError(f"Unknown detection strategy: {strategy}")
+
+def _find_quadrilateral(edges, frame_area, profile):
+    """Return the first large enough 4-point contour in an edge image, or None"""
     # Find contours in the edged image
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
     # Sort contours by area in descending order
-    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:profile.max_contours]
     
-    document_detected = False
-    document_coords = None
-    
-    # Loop through the contours
     for contour in contours:
         # Approximate the contour
         perimeter = cv2.arcLength(contour, True)
-        approx = cv2.approxPolyDP(contour, 0.02 * perimeter, True)
+        approx = cv2.approxPolyDP(contour, profile.epsilon_ratio * perimeter, True)
         
         # If the contour has 4 points, it's likely to be the document
         if len(approx) == 4:
             # Additional check: make sure it's large enough to be an ID
             area = cv2.contourArea(approx)
-            frame_area = frame.shape[0] * frame.shape[1]
-            min_area_ratio = 0.05  # Document should be at least 5% of the frame
-            max_area_ratio = 0.9   # Document should not be more than 90% of the frame
-            
-            if min_area_ratio * frame_area < area < max_area_ratio * frame_area:
-                # Draw the contour on the processed frame
-                cv2.drawContours(processed_frame, [approx], -1, (0, 255, 0), 3)
-                
-                # Add corner markers
-                for point in approx:
-                    x, y = point[0]
-                    cv2.circle(processed_frame, (x, y), 5, (0, 0, 255), -1)
-                
-                # Add "ID DETECTED" text
-                cv2.putText(processed_frame, "ID DETECTED", (10, 30), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                
-                document_detected = True
-                document_coords = approx
-                break
+            if profile.min_area_ratio * frame_area < area < profile.max_area_ratio * frame_area:
+                return approx
+    
+    return None
+
+def find_document_contour(frame, profile=DEFAULT_PROFILE):
+    """
+    Find the ID document in a frame without drawing anything
+    
+    The Canny pass runs first; the more expensive fallback strategies of the
+    profile only run when it finds nothing.
+    
+    Args:
+        frame: Camera frame (numpy array)
+        profile: DetectorProfile
+        
+    Returns:
+        document_coords: Coordinates of the document if detected, None otherwise
+        strategy: Name of the strategy that found the document, None otherwise
+    """
+    # Convert to grayscale
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    
+    # Apply Gaussian blur to reduce noise
+    blurred = cv2.GaussianBlur(gray, (profile.blur_kernel, profile.blur_kernel), 0)
+    
+    frame_area = frame.shape[0] * frame.shape[1]
+    
+    for strategy in ("canny",) + tuple(profile.fallbacks):
+        edges = _edge_map(blurred, strategy, profile)
+        approx = _find_quadrilateral(edges, frame_area, profile)
+        if approx is not None:
+            return approx, strategy
+    
+    return None, None
+
+def detect_document(frame, profile=DEFAULT_PROFILE):
+    """
+    Detect ID document in a frame and return the document contour
+    
+    Args:
+        frame: Camera frame (numpy array)
+        profile: DetectorProfile with the detection parameters
+        
+    Returns:
+        processed_frame: Frame with detected document highlighted
+        document_detected: Boolean indicating if document was detected
+        document_coords: Coordinates of the document if detected, None otherwise
+    """
+    # Make a copy of the frame to avoid modifying the original
+    processed_frame = frame.copy()
+    
+    document_coords, _ = find_document_contour(frame, profile)
+    document_detected = document_coords is not None
+    
+    if document_detected:
+        # Draw the contour on the processed frame
+        cv2.drawContours(processed_frame, [document_coords], -1, (0, 255, 0), 3)
+        
+        # Add corner markers
+        for point in document_coords:
+            x, y = point[0]
+            cv2.circle(processed_frame, (int(x), int(y)), 5, (0, 0, 255), -1)
+        
+        # Add "ID DETECTED" text
+        cv2.putText(processed_frame, "ID DETECTED", (10, 30), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
     
     # If no document is detected, add helper rectangle
-    if not document_detected:
+    else:
         h, w = frame.shape[:2]
         # Draw guide rectangle
         cv2.rectangle(processed_frame, (int(w*0.2), int(h*0.2)), 
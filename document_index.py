@@ -0,0 +1,433 @@
+"""
+Perceptual-hash index of previously extracted ID documents
+
+Every rectified document that goes through extraction is stored as a 64-bit
+perceptual hash together with its extracted id_number, so fraud teams can see
+when one card shows up across many sessions. The rest of the extracted data is
+not kept.
+
+The hash is computed from a 32x32 downsample and mostly captures the card
+layout: different cards of the same type are often only a few bits apart. A hash
+match alone therefore never identifies a card. A sighting is an earlier entry
+with the same extracted id_number and a hash within DEFAULT_MAX_DISTANCE.
+
+Hashes are kept in packed uint64 files that are memory-mapped. Sightings are
+found by binary search in a sorted copy of the id_number hashes. Near-neighbour
+search by image uses multi-index hashing: the 64 bits are split into four 16-bit
+substrings, each with a bucket table, and any hash within distance r of the
+query matches at least one substring within distance r // 4.
+
+Usage:
+    python document_index.py INDEX_DIR --image rectified.jpg
+    python document_index.py INDEX_DIR --id-number AB123456
+    python document_index.py --bench 1000000
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from itertools import combinations
+
+import cv2
+import numpy as np
+
+from file_lock import file_lock
+
+# Search radius in bits, also used to confirm sightings
+DEFAULT_MAX_DISTANCE = 8
+
+SUBSTRINGS = 4
+SUBSTRING_BITS = 64 // SUBSTRINGS
+
+# Entries appended after the bucket tables were built are scanned linearly until
+# there are this many of them, then the tables are rebuilt
+MAX_TAIL = 65536
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """Number of set bits of each uint64 value"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+def perceptual_hash(image):
+    """
+    64-bit DCT perceptual hash of an image
+
+    Args:
+        image: BGR or grayscale image (numpy array)
+
+    Returns:
+        phash: Hash as a Python int
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+
+    # Compare against the median of the AC coefficients; the DC term only reflects brightness
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _normalise_id(id_number):
+    """id_number as a comparable string; the model may return it as a number"""
+    return "" if id_number is None else str(id_number).strip().upper()
+
+
+def _text_hash(text):
+    """Stable 64-bit hash of a string, used to match id_numbers without loading records"""
+    return int.from_bytes(hashlib.blake2b(_normalise_id(text).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _probe_masks(radius):
+    """All SUBSTRING_BITS-bit masks with at most `radius` bits set"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(SUBSTRING_BITS), r):
+            masks.append(sum(1 << b for b in bits))
+    return np.array(masks, dtype=np.uint64)
+
+
+def _substrings(hashes):
+    """Split uint64 hashes into SUBSTRINGS arrays of uint16"""
+    mask = np.uint64((1 << SUBSTRING_BITS) - 1)
+    return [((hashes >> np.uint64(k * SUBSTRING_BITS)) & mask).astype(np.int64) for k in range(SUBSTRINGS)]
+
+
+class DocumentIndex:
+    """
+    Append-only index of document hashes and extraction records
+
+    Files in the index directory:
+        hashes.u64      perceptual hash per entry
+        ids.u64         hash of the extracted id_number per entry (0 if none)
+        offsets.u64     byte offset of each entry in records.jsonl
+        records.jsonl   one JSON record per entry
+        mih-N-*.npy     cached bucket tables and sorted id hashes for the first N entries
+        index.lock      serialises appends and table builds between processes
+
+    Safe to share between threads. Several processes on one host may append to
+    the same directory; each picks up the others' entries on its next search.
+
+    Args:
+        path: Index directory (created if needed)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        for name in ("hashes.u64", "ids.u64", "offsets.u64", "records.jsonl"):
+            open(os.path.join(path, name), "ab").close()
+
+        self._count = 0
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._ids = np.zeros(0, dtype=np.uint64)
+        self._offsets = np.zeros(0, dtype=np.uint64)
+        self._table_count = 0
+        self._tables = None
+        self._id_table = None
+        self._masks = {}
+        self._refresh()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, phash, record):
+        """
+        Append a document
+
+        Args:
+            phash: Perceptual hash from perceptual_hash
+            record: JSON-serialisable dict; its "id_number", if any, is indexed
+
+        Returns:
+            row: Row number of the new entry
+        """
+        id_hash = _text_hash(record["id_number"]) if _normalise_id(record.get("id_number")) else 0
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+        with self._lock, file_lock(os.path.join(self.path, "index.lock")):
+            row = os.path.getsize(os.path.join(self.path, "hashes.u64")) // 8
+            with open(os.path.join(self.path, "records.jsonl"), "ab") as records:
+                offset = records.seek(0, os.SEEK_END)
+                records.write(line)
+            # The hash file is written last: its length is the number of complete entries.
+            # The other files are written at the row, dropping what a crashed append left behind.
+            self._write_row("offsets.u64", row, offset)
+            self._write_row("ids.u64", row, id_hash)
+            self._write_row("hashes.u64", row, phash)
+
+        return row
+
+    def search(self, phash, max_distance=DEFAULT_MAX_DISTANCE, limit=10):
+        """
+        Find entries within a Hamming distance of a hash
+
+        Args:
+            phash: Perceptual hash from perceptual_hash
+            max_distance: Maximum Hamming distance in bits
+            limit: Maximum number of results
+
+        Returns:
+            matches: List of (distance, row) tuples, nearest first
+        """
+        self._refresh()
+        with self._lock:
+            hashes, tables, table_count = self._hashes, self._tables, self._table_count
+
+        query = np.uint64(phash)
+        candidates = [np.arange(table_count, len(hashes))]
+
+        if table_count:
+            radius = max_distance // SUBSTRINGS
+            masks = self._masks.get(radius)
+            if masks is None:
+                masks = self._masks[radius] = _probe_masks(radius)
+
+            for k, (order, starts) in enumerate(tables):
+                probes = ((query >> np.uint64(k * SUBSTRING_BITS)) & np.uint64(0xFFFF)) ^ masks
+                probes = probes.astype(np.int64)
+
+                # Gather all probed buckets with one fancy index instead of a slice per bucket
+                begins, lengths = starts[probes], starts[probes + 1] - starts[probes]
+                positions = np.arange(lengths.sum()) + np.repeat(begins - (np.cumsum(lengths) - lengths), lengths)
+                candidates.append(order[positions])
+
+        rows = np.concatenate(candidates)
+        if not len(rows):
+            return []
+
+        # A row may be found through several substrings
+        distances = popcount(hashes[rows] ^ query)
+        keep = distances <= max_distance
+        rows, first = np.unique(rows[keep], return_index=True)
+        distances = distances[keep][first]
+        nearest = np.argsort(distances, kind="stable")[:limit]
+        return [(int(distances[i]), int(rows[i])) for i in nearest]
+
+    def rows_with_id_number(self, id_number):
+        """Rows whose extracted id_number matches, oldest first"""
+        self._refresh()
+        with self._lock:
+            ids, id_table, table_count = self._ids, self._id_table, self._table_count
+
+        key = np.uint64(_text_hash(id_number))
+        rows = []
+        if table_count:
+            # Binary search in the sorted id hashes; the stable sort keeps equal ids in row order
+            sorted_ids, order = id_table
+            begin, end = np.searchsorted(sorted_ids, key, "left"), np.searchsorted(sorted_ids, key, "right")
+            rows.extend(order[begin:end].tolist())
+        rows.extend((np.flatnonzero(ids[table_count:] == key) + table_count).tolist())
+        return rows
+
+    def sightings(self, phash, id_number, max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        Earlier scans of the same card
+
+        Args:
+            phash: Perceptual hash of the new scan
+            id_number: id_number extracted from the new scan
+            max_distance: Maximum Hamming distance in bits
+
+        Returns:
+            rows: Rows with the same id_number and a hash within max_distance, oldest first
+        """
+        if not _normalise_id(id_number):
+            return []
+        rows = np.asarray(self.rows_with_id_number(id_number), dtype=np.int64)
+        if not len(rows):
+            return []
+        distances = popcount(self._hashes[rows] ^ np.uint64(phash))
+        return rows[distances <= max_distance].tolist()
+
+    def record(self, row):
+        """Return the record stored for a row"""
+        with open(os.path.join(self.path, "records.jsonl"), "rb") as records:
+            records.seek(int(self._offsets[row]))
+            return json.loads(records.readline())
+
+    def _write_row(self, name, row, value):
+        """Write the value of a row and cut the file after it"""
+        with open(os.path.join(self.path, name), "r+b") as f:
+            f.seek(row * 8)
+            f.write(np.uint64(value).tobytes())
+            f.truncate()
+
+    def _map(self, name, count):
+        if count == 0:
+            return np.zeros(0, dtype=np.uint64)
+        return np.memmap(os.path.join(self.path, name), dtype=np.uint64, mode="r", shape=(count,))
+
+    def _refresh(self):
+        """Map entries appended since the last call, by this or another process"""
+        count = os.path.getsize(os.path.join(self.path, "hashes.u64")) // 8
+        if count == self._count:
+            return
+
+        with self._lock:
+            self._hashes = self._map("hashes.u64", count)
+            self._ids = self._map("ids.u64", count)
+            self._offsets = self._map("offsets.u64", count)
+            self._count = count
+            if count - self._table_count > MAX_TAIL or (self._tables is None and count):
+                self._tables, self._id_table, self._table_count = self._load_tables(count)
+
+    def _load_tables(self, count):
+        """Load the bucket and id tables for the first `count` entries, building and caching them if needed"""
+        names = [f"mih-{count}-order.npy", f"mih-{count}-starts.npy", f"mih-{count}-ids.npy",
+                 f"mih-{count}-id-order.npy"]
+        paths = [os.path.join(self.path, name) for name in names]
+        if all(os.path.exists(path) for path in paths):
+            orders, starts, sorted_ids, id_order = (np.load(path, mmap_mode="r") for path in paths)
+            return list(zip(orders, starts)), (sorted_ids, id_order), count
+
+        orders = np.empty((SUBSTRINGS, count), dtype=np.int64)
+        starts = np.zeros((SUBSTRINGS, (1 << SUBSTRING_BITS) + 1), dtype=np.int64)
+        for k, values in enumerate(_substrings(np.asarray(self._hashes[:count]))):
+            orders[k] = np.argsort(values, kind="stable")
+            np.cumsum(np.bincount(values, minlength=1 << SUBSTRING_BITS), out=starts[k, 1:])
+
+        ids = np.asarray(self._ids[:count])
+        id_order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[id_order]
+
+        # Write the cache atomically and drop caches for older entry counts. On
+        # Windows a file another process has mapped can be neither replaced nor
+        # removed; such files are left for a later build to clean up.
+        with file_lock(os.path.join(self.path, "index.lock")):
+            for path, table in zip(paths, (orders, starts, sorted_ids, id_order)):
+                if os.path.exists(path):
+                    continue
+                handle, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+                with os.fdopen(handle, "wb") as f:
+                    np.save(f, table)
+                os.replace(temp_path, path)
+            for name in os.listdir(self.path):
+                if name.startswith("mih-") and name not in names:
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass
+
+        return list(zip(orders, starts)), (sorted_ids, id_order), count
+
+
+def bench(entries, queries=1000, max_distances=(4, 8, 12), seed=0):
+    """
+    Measure lookup latency on an index of random hashes and id_numbers
+
+    search is what the command line uses to look up an image; sightings is what
+    the app runs for every extracted document. One query in ten is a perturbed
+    copy of an indexed entry, the rest are random.
+
+    Returns:
+        report: List of lines describing build time and latency percentiles
+    """
+    rng = np.random.default_rng(seed)
+    path = tempfile.mkdtemp(prefix="document-index-bench-")
+    lines = []
+
+    try:
+        hashes = rng.integers(0, np.iinfo(np.uint64).max, size=entries, dtype=np.uint64, endpoint=True)
+        hashes.tofile(os.path.join(path, "hashes.u64"))
+        # About two scans per card
+        id_numbers = rng.integers(0, max(entries // 2, 1), size=entries)
+        ids = np.array([_text_hash(f"ID{n:09d}") for n in range(max(entries // 2, 1))], dtype=np.uint64)[id_numbers]
+        ids.tofile(os.path.join(path, "ids.u64"))
+        np.zeros(entries, dtype=np.uint64).tofile(os.path.join(path, "offsets.u64"))
+
+        started = time.perf_counter()
+        index = DocumentIndex(path)
+        lines.append(f"{entries} entries, bucket tables built in {time.perf_counter() - started:.2f} s")
+
+        started = time.perf_counter()
+        DocumentIndex(path)
+        lines.append(f"Reopened from cached tables in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        flips = np.uint64(1) << rng.integers(0, 64, size=(queries, 3)).astype(np.uint64)
+        target_rows = rng.integers(0, entries, size=queries)
+        targets = hashes[target_rows] ^ flips[:, 0] ^ flips[:, 1] ^ flips[:, 2]
+        random_queries = rng.integers(0, np.iinfo(np.uint64).max, size=queries, dtype=np.uint64, endpoint=True)
+        is_target = np.arange(queries) % 10 == 0
+        query_set = np.where(is_target, targets, random_queries)
+        query_ids = [f"ID{id_numbers[row]:09d}" if hit else f"NEW{i:09d}"
+                     for i, (row, hit) in enumerate(zip(target_rows, is_target))]
+
+        latencies = []
+        for query, id_number in zip(query_set, query_ids):
+            started = time.perf_counter()
+            index.sightings(int(query), id_number)
+            latencies.append((time.perf_counter() - started) * 1000)
+        lines.append(f"sightings (app path)  p50 {np.percentile(latencies, 50):.3f} ms  "
+                     f"p99 {np.percentile(latencies, 99):.3f} ms")
+
+        for max_distance in max_distances:
+            latencies = []
+            for query in query_set:
+                started = time.perf_counter()
+                index.search(int(query), max_distance)
+                latencies.append((time.perf_counter() - started) * 1000)
+            lines.append(f"search r={max_distance:<3}  p50 {np.percentile(latencies, 50):.3f} ms  "
+                         f"p99 {np.percentile(latencies, 99):.3f} ms")
+
+        started = time.perf_counter()
+        for query in query_set[:20]:
+            np.flatnonzero(popcount(hashes ^ query) <= max_distances[-1])
+        linear = (time.perf_counter() - started) / 20 * 1000
+        started = time.perf_counter()
+        for id_number in query_ids[:20]:
+            np.flatnonzero(ids == np.uint64(_text_hash(id_number)))
+        linear_ids = (time.perf_counter() - started) / 20 * 1000
+        lines.append(f"Linear scans for comparison: {linear:.1f} ms per hash query, "
+                     f"{linear_ids:.1f} ms per id_number query")
+    finally:
+        shutil.rmtree(path)
+
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query or benchmark the document hash index")
+    parser.add_argument("index", nargs="?", help="Index directory")
+    parser.add_argument("--image", help="Rectified document image to look up")
+    parser.add_argument("--id-number", help="List every entry with this id_number")
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE)
+    parser.add_argument("--bench", type=int, metavar="ENTRIES", help="Benchmark lookups on random hashes")
+    args = parser.parse_args()
+
+    if args.bench:
+        print("\n".join(bench(args.bench)))
+        return
+
+    if not args.index:
+        parser.error("An index directory is required")
+    index = DocumentIndex(args.index)
+    print(f"{len(index)} entries")
+
+    if args.image:
+        image = cv2.imread(args.image)
+        if image is None:
+            parser.error(f"Could not read {args.image}")
+        for distance, row in index.search(perceptual_hash(image), args.max_distance, limit=50):
+            record = index.record(row)
+            print(f"distance {distance:>2}  row {row:>8}  {record.get('id_number', '')}  {record.get('session_id', '')}")
+
+    if args.id_number:
+        for row in index.rows_with_id_number(args.id_number):
+            record = index.record(row)
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(record.get("time", 0)))
+            print(f"row {row:>8}  {when}  session {record.get('session_id', '')}")
+
+
+if __name__ == "__main__":
+    main()
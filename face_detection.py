@@ -0,0 +1,50 @@
+import cv2
+
+# detectMultiScale parameters used for the live face camera
+SCALE_FACTOR = 1.3
+MIN_NEIGHBORS = 5
+
+def load_face_cascade():
+    """
+    Load the Haar cascade used for frontal face detection
+
+    Returns:
+        cascade: cv2.CascadeClassifier
+    """
+    return cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+def detect_faces(frame, cascade, scale_factor=SCALE_FACTOR, min_neighbors=MIN_NEIGHBORS):
+    """
+    Detect faces in a frame
+
+    Args:
+        frame: Camera frame (numpy array, BGR)
+        cascade: Face cascade from load_face_cascade
+        scale_factor: detectMultiScale scale factor
+        min_neighbors: detectMultiScale minimum neighbours
+
+    Returns:
+        faces: List of (x, y, w, h) tuples
+    """
+    # Convert to grayscale for face detection
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    faces = cascade.detectMultiScale(gray, scale_factor, min_neighbors)
+
+    return [tuple(int(v) for v in face) for face in faces]
+
+def draw_faces(frame, faces):
+    """
+    Draw rectangles around detected faces
+
+    Args:
+        frame: Camera frame (numpy array)
+        faces: List of (x, y, w, h) tuples
+
+    Returns:
+        processed_frame: Copy of the frame with the faces highlighted
+    """
+    processed_frame = frame.copy()
+    for (x, y, w, h) in faces:
+        cv2.rectangle(processed_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+    return processed_frame
@@ -0,0 +1,115 @@
+"""
+Local stand-in for the Gemini model
+
+Mimics the small part of the google.generativeai GenerativeModel API that the
+application uses (generate_content returning an object with .text and
+.usage_metadata) so that extraction and verification can be exercised offline
+and at a controlled latency.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+
+# Gemini bills each image as a fixed number of input tokens
+IMAGE_TOKENS = 258
+
+_total_lock = threading.Lock()
+
+
+class FakeUsage:
+    """Token accounting in the shape of Gemini's usage_metadata"""
+
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    """Response object exposing .text and .usage_metadata"""
+
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeGeminiModel:
+    """
+    Deterministic fake of the Gemini model
+
+    Args:
+        latency: Fixed delay in seconds for every call
+        per_image_latency: Additional delay in seconds for every image in a call
+        failure_rate: Probability that an extracted record is returned without an id_number
+        seed: Seed for the failure injection
+    """
+
+    # Calls made by all instances in this process, e.g. across app reruns in a load test
+    total_calls = 0
+
+    def __init__(self, latency=0.0, per_image_latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.per_image_latency = per_image_latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents):
+        """Answer a prompt built the same way as the real application builds it"""
+        prompt = "".join(part for part in contents if isinstance(part, str))
+        images = [part["data"] for part in contents if isinstance(part, dict)]
+
+        with self._lock:
+            self.calls += 1
+        with _total_lock:
+            FakeGeminiModel.total_calls += 1
+
+        delay = self.latency + self.per_image_latency * len(images)
+        if delay > 0:
+            time.sleep(delay)
+
+        if "same_person" in prompt:
+            payload = self._verification(images)
+        elif '"documents"' in prompt:
+            payload = {"documents": [dict(self._record(data), index=i) for i, data in enumerate(images)]}
+        else:
+            payload = self._record(images[0]) if images else {}
+
+        text = "```json\n" + json.dumps(payload, indent=2) + "\n```"
+        usage = FakeUsage(len(prompt) // 4 + IMAGE_TOKENS * len(images), len(text) // 4)
+        return FakeResponse(text, usage)
+
+    def _record(self, data):
+        """Build a plausible ID record derived from the image bytes"""
+        digest = hashlib.sha1(data).hexdigest()
+        record = {
+            "document_type": "ID Card",
+            "id_number": digest[:10].upper(),
+            "full_name": f"Test Person {digest[10:14].upper()}",
+            "date_of_birth": "1990-01-01",
+            "date_of_issue": "2020-01-01",
+            "date_of_expiry": "2030-01-01",
+            "nationality": "",
+            "gender": "",
+            "additional_info": {}
+        }
+
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            record["id_number"] = ""
+
+        return record
+
+    def _verification(self, images):
+        """Build a verification answer; identical images always match"""
+        same = len(images) == 2 and images[0] == images[1]
+        return {
+            "same_person": True,
+            "confidence_score": 100 if same else 87,
+            "remarks": "Synthetic result from the local fake model"
+        }
@@ -0,0 +1,328 @@
+"""
+Frame recording and memory-mapped replay
+
+An opt-in recorder saves the camera frames seen by the app together with the
+detection result and timing of each frame. Frames are stored uncompressed in
+append-only chunk files so that a replay can memory-map them and pass views
+straight to the detectors without decoding or copying.
+
+Recording layout:
+    recording.json      detector profile and face detection parameters in use
+    index.jsonl         one line per frame: source, chunk, offset, shape, timing, result
+    chunk-00000.bin     raw uint8 frames, each starting on a 64 byte boundary
+    recording.lock      serialises appends from several app processes
+
+Usage:
+    ID_SCANNER_RECORD_DIR=recordings/kiosk-12 streamlit run app.py
+    python frame_recording.py recordings/kiosk-12
+    python frame_recording.py recordings/kiosk-12 --profile profile.json --repeat 5
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from document_detection import DEFAULT_PROFILE, DetectorProfile, detect_document, load_profile
+from face_detection import MIN_NEIGHBORS, SCALE_FACTOR, detect_faces, load_face_cascade
+from file_lock import file_lock
+
+FORMAT_VERSION = 1
+
+DEFAULT_CHUNK_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+ALIGNMENT = 64
+
+# Corner distance in pixels above which a replayed detection counts as different
+CORNER_TOLERANCE = 2.0
+
+
+class FrameRecorder:
+    """
+    Append camera frames and their detection results to a recording
+
+    Safe to share between Streamlit sessions (threads), and several app
+    processes on one host may record into the same directory: appends are
+    serialised with a lock file, and each process catches up with the frames
+    written by the others before it appends. Recording stops silently once
+    max_bytes of frame data have been written.
+
+    Args:
+        path: Recording directory (created if needed, appended to if it exists)
+        profile: DetectorProfile used by the app
+        chunk_bytes: Size at which a new chunk file is started
+        max_bytes: Total frame data budget
+    """
+
+    def __init__(self, path, profile=DEFAULT_PROFILE, chunk_bytes=DEFAULT_CHUNK_BYTES, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(path, "recording.lock")
+
+        os.makedirs(path, exist_ok=True)
+        with file_lock(self._lock_path):
+            header_path = os.path.join(path, "recording.json")
+            if not os.path.exists(header_path):
+                with open(header_path, "w") as f:
+                    json.dump({
+                        "version": FORMAT_VERSION,
+                        "created": time.time(),
+                        "detector_profile": profile.to_dict(),
+                        "face_detection": {"scale_factor": SCALE_FACTOR, "min_neighbors": MIN_NEIGHBORS}
+                    }, f, indent=2)
+
+            # Continue after any frames already in the recording
+            self._seq = 0
+            self._chunk = 0
+            self._total_bytes = 0
+            self._index_pos = 0
+            self._index = open(os.path.join(path, "index.jsonl"), "a+b")
+            self._catch_up()
+
+        self._chunk_file = None
+
+    def record(self, source, frame, elapsed, result):
+        """
+        Append a frame
+
+        Args:
+            source: "document" or "face"
+            frame: Camera frame (numpy array)
+            elapsed: Detection time in seconds as observed by the app
+            result: JSON-serialisable detection result
+
+        Returns:
+            recorded: False if the recording budget is exhausted
+        """
+        frame = np.ascontiguousarray(frame)
+
+        with self._lock, file_lock(self._lock_path):
+            self._catch_up()
+            if self._total_bytes + frame.nbytes > self.max_bytes:
+                return False
+
+            # Other processes append to the same chunk, so the end of the file is the offset
+            chunk_file = self._open_chunk()
+            offset = os.fstat(chunk_file.fileno()).st_size
+            if offset and offset + frame.nbytes > self.chunk_bytes:
+                self._chunk += 1
+                chunk_file = self._open_chunk()
+                offset = os.fstat(chunk_file.fileno()).st_size
+
+            padding = -offset % ALIGNMENT
+            if padding:
+                chunk_file.write(b"\0" * padding)
+                offset += padding
+
+            chunk_file.write(memoryview(frame).cast("B"))
+            chunk_file.flush()
+
+            entry = {
+                "seq": self._seq,
+                "source": source,
+                "time": time.time(),
+                "chunk": self._chunk,
+                "offset": offset,
+                "shape": list(frame.shape),
+                "nbytes": frame.nbytes,
+                "elapsed_ms": elapsed * 1000,
+                "result": result
+            }
+            self._index.write((json.dumps(entry) + "\n").encode("utf-8"))
+            self._index.flush()
+            self._index_pos = self._index.tell()
+
+            self._seq += 1
+            self._total_bytes += frame.nbytes
+
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._chunk_file is not None:
+                self._chunk_file.close()
+            self._index.close()
+
+    def _catch_up(self):
+        """Read index entries appended since the last call, by this or another process (file lock held)"""
+        self._index.seek(self._index_pos)
+        data = self._index.read()
+        complete = data.rfind(b"\n") + 1
+
+        # A line without its newline was cut short by a crash; drop it so the next entry starts cleanly
+        if complete < len(data):
+            self._index.truncate(self._index_pos + complete)
+
+        for line in data[:complete].splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            self._seq = entry["seq"] + 1
+            self._chunk = max(self._chunk, entry["chunk"])
+            self._total_bytes += entry["nbytes"]
+        self._index_pos += complete
+
+    def _open_chunk(self):
+        """Return the file of the current chunk, opened for appending"""
+        path = self._chunk_path(self._chunk)
+        if self._chunk_file is None or self._chunk_file.name != path:
+            if self._chunk_file is not None:
+                self._chunk_file.close()
+            self._chunk_file = open(path, "ab")
+        return self._chunk_file
+
+    def _chunk_path(self, chunk):
+        return os.path.join(self.path, f"chunk-{chunk:05d}.bin")
+
+
+class Recording:
+    """
+    Read-only view of a recording
+
+    Args:
+        path: Recording directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "recording.json"), "r") as f:
+            self.header = json.load(f)
+        with open(os.path.join(path, "index.jsonl"), "r") as f:
+            # The last line may still be being written, or cut short by a crash
+            lines = f.read().split("\n")[:-1]
+        self.entries = [json.loads(line) for line in lines if line.strip()]
+        self._chunks = {}
+
+    @property
+    def profile(self):
+        """DetectorProfile the frames were recorded with"""
+        return DetectorProfile.from_dict(self.header["detector_profile"])
+
+    def frame(self, entry):
+        """
+        Return a recorded frame as a read-only view into the memory-mapped chunk
+
+        Args:
+            entry: Index entry from self.entries
+
+        Returns:
+            frame: numpy array (not a copy)
+        """
+        chunk = self._chunks.get(entry["chunk"])
+        if chunk is None:
+            chunk = np.memmap(os.path.join(self.path, f"chunk-{entry['chunk']:05d}.bin"), dtype=np.uint8, mode="r")
+            self._chunks[entry["chunk"]] = chunk
+        return np.ndarray(entry["shape"], dtype=np.uint8, buffer=chunk, offset=entry["offset"])
+
+
+def _corners_match(recorded, replayed):
+    """True if two corner lists are the same document within CORNER_TOLERANCE"""
+    if recorded is None or replayed is None:
+        return recorded is None and replayed is None
+    recorded = np.asarray(recorded, dtype=np.float32).reshape(-1, 2)
+    replayed = np.asarray(replayed, dtype=np.float32).reshape(-1, 2)
+    if recorded.shape != replayed.shape:
+        return False
+    # Compare as point sets; the contour may start at a different corner
+    distances = np.linalg.norm(recorded[:, None, :] - replayed[None, :, :], axis=2)
+    return bool(distances.min(axis=1).max() <= CORNER_TOLERANCE)
+
+
+def _faces_match(recorded, replayed):
+    """True if both detections found the same boxes, in any order"""
+    return sorted(map(tuple, recorded)) == sorted(map(tuple, replayed))
+
+
+def replay(recording, profile=None, repeat=1):
+    """
+    Feed every recorded frame back through the detectors at full speed
+
+    Args:
+        recording: Recording
+        profile: DetectorProfile to replay with (defaults to the recorded one)
+        repeat: Passes over the recording; timings use the fastest pass
+
+    Returns:
+        report: Dict per source with recorded and replayed timings and mismatching frame numbers
+    """
+    profile = profile or recording.profile
+    face_params = recording.header.get("face_detection", {})
+    cascade = load_face_cascade()
+
+    timings = {}
+    outputs = {}
+    for _ in range(repeat):
+        for entry in recording.entries:
+            frame = recording.frame(entry)
+            started = time.perf_counter()
+            if entry["source"] == "document":
+                _, _, coords = detect_document(frame, profile)
+                output = coords.reshape(-1, 2).tolist() if coords is not None else None
+            else:
+                output = detect_faces(frame, cascade, **face_params)
+            elapsed = (time.perf_counter() - started) * 1000
+
+            seq = entry["seq"]
+            timings[seq] = min(elapsed, timings.get(seq, elapsed))
+            outputs[seq] = output
+
+    report = {}
+    for entry in recording.entries:
+        source = report.setdefault(entry["source"], {"recorded_ms": [], "replayed_ms": [], "mismatches": []})
+        source["recorded_ms"].append(entry["elapsed_ms"])
+        source["replayed_ms"].append(timings[entry["seq"]])
+
+        if entry["source"] == "document":
+            same = _corners_match(entry["result"]["coords"], outputs[entry["seq"]])
+        else:
+            same = _faces_match(entry["result"]["faces"], outputs[entry["seq"]])
+        if not same:
+            source["mismatches"].append(entry["seq"])
+
+    return report
+
+
+def format_report(report):
+    """Format a replay report as a plain text table"""
+    header = f"{'source':<10} {'frames':>7} {'rec p50':>8} {'rec p95':>8} {'replay p50':>11} " \
+             f"{'replay p95':>11} {'mismatch':>9}"
+    lines = [header, "-" * len(header)]
+    for name, source in sorted(report.items()):
+        recorded = np.asarray(source["recorded_ms"])
+        replayed = np.asarray(source["replayed_ms"])
+        lines.append(f"{name:<10} {len(recorded):>7} {np.percentile(recorded, 50):>8.2f} "
+                     f"{np.percentile(recorded, 95):>8.2f} {np.percentile(replayed, 50):>11.2f} "
+                     f"{np.percentile(replayed, 95):>11.2f} {len(source['mismatches']):>9}")
+    lines.append("")
+    lines.append("Times in ms. Recorded times are as observed by the app and include any worker pool queueing.")
+    for name, source in sorted(report.items()):
+        if source["mismatches"]:
+            shown = ", ".join(str(seq) for seq in source["mismatches"][:20])
+            more = " ..." if len(source["mismatches"]) > 20 else ""
+            lines.append(f"{name} frames with different output: {shown}{more}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a frame recording through the detectors")
+    parser.add_argument("recording", help="Recording directory")
+    parser.add_argument("--profile", help="Replay with this detector profile instead of the recorded one")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the recording")
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    if not recording.entries:
+        parser.error("Recording contains no frames")
+
+    profile = load_profile(args.profile) if args.profile else None
+    print(format_report(replay(recording, profile, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+ID document extraction request
+
+The prompt, image encoding and response handling used to extract data from a
+rectified ID document. Shared by the application and batch_extraction.py so
+that the one-document-per-call baseline is exactly what the application sends.
+"""
+
+import io
+
+import cv2
+from PIL import Image
+
+from json_utils import extract_json_from_text, format_json_for_display, validate_id_data
+
+EXTRACTION_PROMPT = """
+        Extract all information from this ID document image.
+        Return the data in the following JSON format:
+        {
+            "document_type": "ID Card/Passport/Driver's License",
+            "id_number": "",
+            "full_name": "",
+            "date_of_birth": "",
+            "date_of_issue": "",
+            "date_of_expiry": "",
+            "nationality": "",
+            "gender": "",
+            "additional_info": {}
+        }
+        If any field is not visible or cannot be determined, leave it as an empty string.
+        For additional_info, include any other fields present on the document.
+        """
+
+
+def encode_document(image):
+    """
+    Encode a document image the way it is sent to the model
+
+    Args:
+        image: BGR image (numpy array)
+
+    Returns:
+        data: JPEG encoded bytes
+    """
+    pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    byte_stream = io.BytesIO()
+    pil_image.save(byte_stream, format='JPEG')
+    return byte_stream.getvalue()
+
+
+def extraction_request(data):
+    """
+    Build the contents of an extraction call
+
+    Args:
+        data: JPEG bytes from encode_document
+
+    Returns:
+        contents: List to pass to generate_content
+    """
+    return [EXTRACTION_PROMPT, {"mime_type": "image/jpeg", "data": data}]
+
+
+def parse_extraction_response(text):
+    """
+    Validate and format the record returned for an extraction call
+
+    Args:
+        text: Response text from the model
+
+    Returns:
+        success: Boolean indicating if the record passed validation
+        data: Formatted JSON string, or an "Invalid ID data" message
+    """
+    _, json_str = extract_json_from_text(text)
+
+    is_valid, validation_message = validate_id_data(json_str)
+    if not is_valid:
+        return False, f"Invalid ID data: {validation_message}"
+
+    return True, format_json_for_display(json_str)
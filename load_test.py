@@ -0,0 +1,561 @@
+"""
+Concurrent-session load test for the Streamlit app
+
+Simulates N concurrent sessions, each walking the full
+id_scan -> show_data -> face_verify -> result flow through streamlit's AppTest,
+with recorded or synthetic camera frames and the local fake model in place of
+Gemini. Reports p50/p95/p99 latency per page, throughput, CPU time and peak RSS,
+and flags regressions against a stored baseline.
+
+Usage:
+    python load_test.py --sessions 8 --flows 3 --model-latency 1.5
+    python load_test.py --sessions 8 --save-baseline load_baseline.json
+    python load_test.py --sessions 8 --baseline load_baseline.json
+
+Frames are read from --frames DIR, which must contain an id_document_camera/
+and a face_verification_camera/ sub-directory of images. Without --frames a
+synthetic set is generated.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+PAGES = ["id_scan", "show_data", "face_verify", "result"]
+
+# A flow is abandoned after this many interactions without reaching the result page
+MAX_STEPS = 20
+
+# Interactions on the same page before falling back to the manual capture button
+AUTO_CAPTURE_ATTEMPTS = 3
+
+# Seconds between samples of the CPU time and memory of the OpenCV worker processes
+WORKER_SAMPLE_INTERVAL = 0.5
+
+
+def write_synthetic_frames(directory, count=5, seed=0):
+    """
+    Write synthetic camera frames for both cameras
+
+    ID frames contain a light card on a darker background so that
+    detect_document finds it; face frames contain a drawn face with the eye,
+    brow and nose-bridge contrast the Haar cascade looks for.
+
+    Args:
+        directory: Output directory
+        count: Number of frames per camera
+        seed: Random seed
+    """
+    rng = np.random.default_rng(seed)
+    id_dir = os.path.join(directory, "id_document_camera")
+    face_dir = os.path.join(directory, "face_verification_camera")
+    os.makedirs(id_dir, exist_ok=True)
+    os.makedirs(face_dir, exist_ok=True)
+
+    for i in range(count):
+        frame = rng.integers(30, 70, size=(480, 640, 3), dtype=np.uint8)
+        offset = rng.integers(-20, 20, size=(4, 2))
+        corners = np.array([[140, 110], [500, 120], [510, 350], [130, 340]]) + offset
+        cv2.fillPoly(frame, [corners.astype(np.int32)], (225, 225, 220))
+        cv2.rectangle(frame, (170, 150), (260, 280), (90, 90, 90), -1)
+        for line in range(6):
+            cv2.putText(frame, f"ID {i:06d} LINE {line}", (280, 160 + 28 * line), cv2.FONT_HERSHEY_SIMPLEX, 0.6,
+                        (40, 40, 40), 2)
+        cv2.imwrite(os.path.join(id_dir, f"frame_{i:03d}.jpg"), frame)
+
+        face = np.full((480, 640, 3), (110, 120, 125), dtype=np.uint8)
+        cx, cy = np.array([320, 240]) + rng.integers(-8, 8, size=2)
+        cv2.ellipse(face, (cx, cy - 40), (115, 130), 0, 0, 360, (40, 45, 50), -1)
+        cv2.ellipse(face, (cx, cy + 10), (100, 130), 0, 0, 360, (150, 175, 205), -1)
+        for dx in (-40, 40):
+            cv2.ellipse(face, (cx + dx, cy - 45), (30, 8), 0, 180, 360, (50, 50, 60), -1)
+            cv2.ellipse(face, (cx + dx, cy - 20), (22, 11), 0, 0, 360, (235, 235, 235), -1)
+            cv2.circle(face, (cx + dx, cy - 20), 9, (40, 30, 30), -1)
+            cv2.ellipse(face, (cx + dx, cy - 8), (25, 6), 0, 0, 180, (120, 140, 170), -1)
+        cv2.line(face, (cx, cy - 15), (cx, cy + 35), (175, 200, 230), 10)
+        cv2.ellipse(face, (cx, cy + 40), (22, 8), 0, 0, 360, (110, 125, 160), -1)
+        cv2.ellipse(face, (cx, cy + 75), (40, 12), 0, 0, 360, (70, 70, 150), -1)
+        face = cv2.GaussianBlur(face, (5, 5), 0)
+        face = np.clip(face + rng.integers(-12, 12, size=face.shape), 0, 255).astype(np.uint8)
+        cv2.imwrite(os.path.join(face_dir, f"frame_{i:03d}.jpg"), face)
+
+
+def share_apptest_runtime():
+    """
+    Let AppTest instances run concurrently in threads
+
+    AppTest installs a mock Runtime for the duration of each run and clears it
+    afterwards, which breaks sessions that are mid-run in other threads. Keep the
+    most recently installed mock available for the rest of the process.
+
+    Every AppTest also compiles the script with its own cache, and concurrent
+    compiles can fail with "AST constructor recursion depth mismatch" on
+    Python 3.11, so compiles are serialised across all sessions.
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    original_get_bytecode = ScriptCache.get_bytecode
+    compile_lock = threading.Lock()
+
+    def get_bytecode(self, script_path):
+        with compile_lock:
+            return original_get_bytecode(self, script_path)
+
+    ScriptCache.get_bytecode = get_bytecode
+
+    original_instance = Runtime.instance.__func__
+    latest = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest[:] = [cls._instance]
+            return cls._instance
+        if latest:
+            return latest[0]
+        return original_instance(cls)
+
+    def exists(cls):
+        return cls._instance is not None or bool(latest)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+
+def time_script_runs(timings):
+    """
+    Time every script run of every AppTest and attribute it to its page
+
+    A single interaction can render several pages, e.g. an auto-captured
+    document is extracted on id_scan and the rerun renders show_data. Each
+    script run is timed on its own and counted under the page that was current
+    when it started.
+
+    Args:
+        timings: Dict of page -> list of durations in seconds to append to
+    """
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    finished = (ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS, ScriptRunnerEvent.SCRIPT_STOPPED_FOR_RERUN,
+                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR)
+    original_init = LocalScriptRunner.__init__
+
+    def __init__(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        current = []
+
+        def on_event(sender, event, **_):
+            if event == ScriptRunnerEvent.SCRIPT_STARTED:
+                state = self._session_state
+                current[:] = [state["page"] if "page" in state else "id_scan", time.perf_counter()]
+            elif event in finished and current:
+                page, started = current
+                timings.setdefault(page, []).append(time.perf_counter() - started)
+                current.clear()
+
+        self.on_event.connect(on_event, weak=False)
+
+    LocalScriptRunner.__init__ = __init__
+
+
+def find_button(at, label=None, key=None):
+    """Return the button with the given label or key from an AppTest, or None"""
+    for button in at.button:
+        if (key is not None and button.key == key) or (label is not None and button.label == label):
+            return button
+    return None
+
+
+def run_session(session_index, flows, timeout, errors, completed):
+    """
+    Walk the verification flow `flows` times in a single simulated session
+
+    Page timings are collected per script run by time_script_runs.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.session_state["auto_capture"] = True
+    at.session_state["auto_capture_face"] = True
+
+    def interact(action):
+        action()
+        if at.exception:
+            raise RuntimeError(f"session {session_index}: {at.exception[0].message}")
+
+    try:
+        interact(at.run)
+
+        for flow in range(flows):
+            flow_started = time.perf_counter()
+            attempts = 0
+            for _ in range(MAX_STEPS):
+                page = at.session_state["page"]
+                if page == "result":
+                    break
+
+                if page == "show_data":
+                    button = find_button(at, label="Continue to Face Verification ➡️")
+                    if button is None:
+                        raise RuntimeError(f"session {session_index}: show_data page has no continue button")
+                    interact(lambda: button.click().run())
+                    attempts = 0
+                    continue
+
+                # Let auto-capture work on fresh frames, then capture manually
+                attempts += 1
+                frame_key = "use_current_frame" if page == "id_scan" else "use_current_face_frame"
+                button = find_button(at, key=frame_key)
+                if attempts > AUTO_CAPTURE_ATTEMPTS and button is not None:
+                    interact(lambda: button.click().run())
+                else:
+                    interact(at.run)
+            else:
+                raise RuntimeError(f"session {session_index}: flow did not reach the result page")
+
+            completed.append(time.perf_counter() - flow_started)
+
+            # Starting over auto-captures the next document, which would count
+            # model calls against no completed flow after the last one
+            if flow + 1 < flows:
+                button = find_button(at, label="🔄 Start Over")
+                if button is not None:
+                    interact(lambda: button.click().run())
+
+    except Exception as e:
+        errors.append(str(e))
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values in milliseconds, or None if empty"""
+    if not values:
+        return None
+    return float(np.percentile(values, q)) * 1000
+
+
+def cpu_seconds():
+    """Return user+system CPU seconds used by this process so far"""
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mb():
+    """Return peak resident set size of this process in MB, or None if unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def _proc_usage(pid):
+    """Return (CPU seconds, peak RSS in MB) of a process from /proc, or None if unavailable"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the parenthesised command name; utime and stime are fields 14 and 15
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            peak_kb = next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), 0)
+    except (OSError, IndexError, ValueError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return (int(fields[11]) + int(fields[12])) / ticks, peak_kb / 1024
+
+
+class WorkerUsage:
+    """
+    Sample the CPU time and peak memory of this process's child processes
+
+    The OpenCV worker pool runs in child processes that RUSAGE_SELF does not
+    cover, and RUSAGE_CHILDREN only covers children that have exited. Live
+    children are sampled from /proc instead, so the figures are only available
+    on Linux.
+    """
+
+    def __init__(self, interval=WORKER_SAMPLE_INTERVAL):
+        self.available = os.path.isdir("/proc/self")
+        self._interval = interval
+        self._start_cpu = {}
+        self._cpu = {}
+        self._peak_mb = {}
+        self._stop = threading.Event()
+        self._sample(initial=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _sample(self, initial=False):
+        if not self.available:
+            return
+        for child in multiprocessing.active_children():
+            usage = _proc_usage(child.pid)
+            if usage is None:
+                continue
+            cpu, peak = usage
+            if initial:
+                self._start_cpu[child.pid] = cpu
+            self._cpu[child.pid] = cpu
+            self._peak_mb[child.pid] = max(peak, self._peak_mb.get(child.pid, 0.0))
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._sample()
+
+    def stop(self):
+        """
+        Take a final sample and stop sampling
+
+        Returns:
+            cpu: CPU seconds used by child processes while sampling, or None if unavailable
+            peak_rss_mb: Sum of the peak RSS of every child process seen, or None if unavailable
+        """
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        if not self.available:
+            return None, None
+        cpu = sum(value - self._start_cpu.get(pid, 0.0) for pid, value in self._cpu.items())
+        return cpu, sum(self._peak_mb.values())
+
+
+def run_load_test(sessions, flows, model_latency, frames_dir, timeout=60, cv_workers=None, quality_gate=True):
+    """
+    Run the load test
+
+    Args:
+        sessions: Number of concurrent sessions
+        flows: Number of complete flows per session
+        model_latency: Latency of the fake model in seconds
+        frames_dir: Directory of camera frames (see module docstring)
+        timeout: AppTest timeout per interaction in seconds
+        cv_workers: OpenCV worker processes for the app (None keeps the app default)
+        quality_gate: False to auto-capture without the local quality gate
+
+    Returns:
+        report: Dict with per page percentiles, throughput, CPU and memory figures;
+            CPU and memory include the OpenCV worker processes where they can be sampled
+    """
+    os.environ["ID_SCANNER_MODEL"] = "fake"
+    os.environ["ID_SCANNER_FAKE_LATENCY"] = str(model_latency)
+    os.environ["ID_SCANNER_FRAME_SOURCE"] = os.path.abspath(frames_dir)
+    if cv_workers is not None:
+        os.environ["ID_SCANNER_CV_WORKERS"] = str(cv_workers)
+    os.environ["ID_SCANNER_QUALITY_GATE"] = "1" if quality_gate else "0"
+
+    # app.py loads style.css relative to the working directory
+    os.chdir(os.path.dirname(APP_PATH))
+    share_apptest_runtime()
+
+    timings = {page: [] for page in PAGES}
+    time_script_runs(timings)
+    errors = []
+    completed = []
+
+    from fake_model import FakeGeminiModel
+    calls_start = FakeGeminiModel.total_calls
+
+    # Exceptions that escape a script thread never reach AppTest.exception; count them as errors
+    previous_excepthook = threading.excepthook
+
+    def record_thread_exception(args):
+        name = args.thread.name if args.thread is not None else "thread"
+        errors.append(f"{name}: {args.exc_type.__name__}: {args.exc_value}")
+        previous_excepthook(args)
+
+    threading.excepthook = record_thread_exception
+
+    cpu_start = cpu_seconds()
+    wall_start = time.perf_counter()
+    worker_usage = WorkerUsage()
+
+    threads = [
+        threading.Thread(target=run_session, args=(i, flows, timeout, errors, completed))
+        for i in range(sessions)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        threading.excepthook = previous_excepthook
+
+    wall = time.perf_counter() - wall_start
+    cpu = cpu_seconds() - cpu_start
+    worker_cpu, worker_rss = worker_usage.stop()
+    rss = peak_rss_mb()
+    model_calls = FakeGeminiModel.total_calls - calls_start
+
+    return {
+        "sessions": sessions,
+        "flows_per_session": flows,
+        "model_latency": model_latency,
+        "quality_gate": quality_gate,
+        "pages": {
+            page: {
+                "count": len(values),
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99)
+            }
+            for page, values in timings.items()
+        },
+        "completed_flows": len(completed),
+        "flow_p50_ms": percentile(completed, 50),
+        "model_calls": model_calls,
+        "model_calls_per_flow": model_calls / len(completed) if completed else None,
+        "throughput_flows_per_s": len(completed) / wall if wall > 0 else 0.0,
+        "wall_s": wall,
+        "cpu_s": cpu + (worker_cpu or 0.0),
+        "cpu_utilization": (cpu + (worker_cpu or 0.0)) / wall if wall > 0 else 0.0,
+        "worker_cpu_s": worker_cpu,
+        "peak_rss_mb": rss + (worker_rss or 0.0) if rss is not None else None,
+        "worker_peak_rss_mb": worker_rss,
+        "errors": errors
+    }
+
+
+def find_regressions(report, baseline, tolerance):
+    """
+    Compare a report against a baseline report
+
+    Args:
+        report: Report from run_load_test
+        baseline: Earlier report loaded from a baseline file
+        tolerance: Allowed relative degradation, e.g. 0.2 for 20%
+
+    Returns:
+        regressions: List of human readable regression descriptions
+    """
+    regressions = []
+
+    for page in PAGES:
+        current = report["pages"][page]["p95_ms"]
+        previous = baseline.get("pages", {}).get(page, {}).get("p95_ms")
+        if current is not None and previous and current > previous * (1 + tolerance):
+            regressions.append(f"{page} p95 {current:.0f} ms vs baseline {previous:.0f} ms")
+
+    previous = baseline.get("throughput_flows_per_s")
+    current = report["throughput_flows_per_s"]
+    if previous and current < previous * (1 - tolerance):
+        regressions.append(f"throughput {current:.2f} flows/s vs baseline {previous:.2f} flows/s")
+
+    previous = baseline.get("peak_rss_mb")
+    current = report["peak_rss_mb"]
+    if previous and current is not None and current > previous * (1 + tolerance):
+        regressions.append(f"peak RSS {current:.0f} MB vs baseline {previous:.0f} MB")
+
+    previous = baseline.get("model_calls_per_flow")
+    current = report["model_calls_per_flow"]
+    if previous and current is not None and current > previous * (1 + tolerance):
+        regressions.append(f"model calls per flow {current:.2f} vs baseline {previous:.2f}")
+
+    if report["errors"] and not baseline.get("errors"):
+        regressions.append(f"{len(report['errors'])} session errors")
+
+    return regressions
+
+
+def format_report(report):
+    """Format a load test report as plain text"""
+
+    def ms(value):
+        return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+
+    lines = [
+        f"{report['sessions']} sessions x {report['flows_per_session']} flows, "
+        f"fake model latency {report['model_latency']} s, quality gate {'on' if report['quality_gate'] else 'off'}",
+        "",
+        f"{'page':<12} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    ]
+    for page in PAGES:
+        stats = report["pages"][page]
+        lines.append(f"{page:<12} {stats['count']:>6} {ms(stats['p50_ms'])} {ms(stats['p95_ms'])} "
+                     f"{ms(stats['p99_ms'])}")
+
+    rss = report["peak_rss_mb"]
+    per_flow = report["model_calls_per_flow"]
+    lines += [
+        "",
+        f"Completed flows: {report['completed_flows']} in {report['wall_s']:.1f} s "
+        f"({report['throughput_flows_per_s']:.2f} flows/s)",
+        f"Model calls: {report['model_calls']} ({per_flow:.2f} per completed flow)" if per_flow is not None
+        else f"Model calls: {report['model_calls']}",
+        f"CPU: {report['cpu_s']:.1f} s ({report['cpu_utilization'] * 100:.0f}% of one core)",
+        f"Peak RSS: {rss:.0f} MB" if rss is not None else "Peak RSS: unavailable",
+    ]
+    if report["worker_cpu_s"] is not None:
+        lines.append(f"  of which OpenCV workers: {report['worker_cpu_s']:.1f} s CPU, "
+                     f"{report['worker_peak_rss_mb']:.0f} MB summed peak RSS")
+    else:
+        lines.append("  OpenCV worker processes could not be sampled and are not included")
+    for error in report["errors"]:
+        lines.append(f"Error: {error}")
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for app.py")
+    parser.add_argument("--sessions", type=int, default=4, help="Number of concurrent sessions")
+    parser.add_argument("--flows", type=int, default=1, help="Complete flows per session")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="Fake model latency in seconds")
+    parser.add_argument("--frames", help="Directory with id_document_camera/ and face_verification_camera/")
+    parser.add_argument("--cv-workers", type=int, help="OpenCV worker processes (0 runs detection inline)")
+    parser.add_argument("--no-quality-gate", action="store_true",
+                        help="Auto-capture without the local quality gate, to measure the calls it saves")
+    parser.add_argument("--timeout", type=float, default=60, help="Timeout per interaction in seconds")
+    parser.add_argument("--baseline", help="Compare against this baseline report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative degradation")
+    parser.add_argument("--save-baseline", help="Write the report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        frames_dir = args.frames
+        if frames_dir is None:
+            frames_dir = temp_dir
+            write_synthetic_frames(frames_dir)
+
+        report = run_load_test(args.sessions, args.flows, args.model_latency, frames_dir, args.timeout,
+                               args.cv_workers, not args.no_quality_gate)
+
+    print(format_report(report))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Local capture-quality gate
+
+Scores the rectified ID document and the face frame before anything is sent to
+Gemini, so that blurry, glared or badly exposed captures and frames without
+exactly one well-placed face are rejected locally with a reason the user can
+act on.
+
+Usage:
+    python quality_gate.py recordings/kiosk-12
+"""
+
+import argparse
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+# Images are scored at this width so that thresholds do not depend on camera resolution
+SCORE_WIDTH = 640
+
+
+@dataclass
+class QualityThresholds:
+    """
+    Limits used by the quality gate
+
+    Attributes:
+        min_sharpness: Minimum variance of the Laplacian
+        max_glare_ratio: Maximum fraction of near-white, unsaturated pixels
+        min_brightness: Minimum mean brightness (0-255)
+        max_brightness: Maximum mean brightness (0-255)
+        max_dark_ratio: Maximum fraction of near-black pixels
+        min_face_ratio: Minimum face width as a fraction of the frame width
+        max_face_offset: Maximum distance of the face centre from the frame centre, as a fraction of the frame size
+    """
+    min_sharpness: float = 100.0
+    max_glare_ratio: float = 0.02
+    min_brightness: float = 60.0
+    max_brightness: float = 200.0
+    max_dark_ratio: float = 0.3
+    min_face_ratio: float = 0.2
+    max_face_offset: float = 0.25
+
+
+DEFAULT_THRESHOLDS = QualityThresholds()
+
+
+def _resize(image):
+    """Downscale to SCORE_WIDTH, keeping the aspect ratio"""
+    h, w = image.shape[:2]
+    if w <= SCORE_WIDTH:
+        return image
+    return cv2.resize(image, (SCORE_WIDTH, int(h * SCORE_WIDTH / w)), interpolation=cv2.INTER_AREA)
+
+
+def image_scores(image):
+    """
+    Measure sharpness, glare and exposure of an image
+
+    Args:
+        image: BGR image (numpy array)
+
+    Returns:
+        scores: Dict with sharpness, glare_ratio, brightness and dark_ratio
+    """
+    small = _resize(image)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    pixels = gray.size
+
+    # Variance of the Laplacian; a 16-bit Laplacian is exact for 8-bit input
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+
+    # Specular highlights are near-white and unsaturated, unlike bright colored print
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    glare = cv2.inRange(hsv, (0, 0, 245), (180, 40, 255))
+
+    return {
+        "sharpness": float(std[0, 0] ** 2),
+        "glare_ratio": cv2.countNonZero(glare) / pixels,
+        "brightness": float(cv2.mean(gray)[0]),
+        "dark_ratio": cv2.countNonZero(cv2.inRange(gray, 0, 19)) / pixels
+    }
+
+
+# Advice shown for each failed image check, per kind of capture
+ADVICE = {
+    "document": {
+        "blurry": "Image is blurry. Hold the document still and make sure the camera is focused.",
+        "glare": "Glare detected on the card. Tilt it away from the light.",
+        "dark": "Image is too dark. Move to a better lit area.",
+        "bright": "Image is overexposed. Avoid direct light on the card."
+    },
+    "face": {
+        "blurry": "Image is blurry. Hold still and make sure the camera is focused.",
+        "glare": "Strong reflections on your face. Avoid direct light or remove glasses.",
+        "dark": "Your face is too dark. Move to a better lit area.",
+        "bright": "Your face is overexposed. Avoid direct light on your face."
+    }
+}
+
+
+def _image_reasons(scores, thresholds, kind):
+    advice = ADVICE[kind]
+    reasons = []
+    if scores["sharpness"] < thresholds.min_sharpness:
+        reasons.append(advice["blurry"])
+    if scores["glare_ratio"] > thresholds.max_glare_ratio:
+        reasons.append(advice["glare"])
+    if scores["brightness"] < thresholds.min_brightness or scores["dark_ratio"] > thresholds.max_dark_ratio:
+        reasons.append(advice["dark"])
+    elif scores["brightness"] > thresholds.max_brightness:
+        reasons.append(advice["bright"])
+    return reasons
+
+
+def score_document(document, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Check whether a rectified ID document is good enough to send for extraction
+
+    Args:
+        document: Rectified document image (numpy array)
+        thresholds: QualityThresholds
+
+    Returns:
+        passed: Boolean indicating if the document passed all checks
+        scores: Dict of measured values
+        reasons: List of messages explaining each failed check
+    """
+    scores = image_scores(document)
+    reasons = _image_reasons(scores, thresholds, "document")
+    return not reasons, scores, reasons
+
+
+def score_face(frame, faces, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Check whether a face frame is good enough to send for verification
+
+    Args:
+        frame: Camera frame (numpy array)
+        faces: List of (x, y, w, h) face boxes detected in the frame
+        thresholds: QualityThresholds
+
+    Returns:
+        passed: Boolean indicating if the frame passed all checks
+        scores: Dict of measured values
+        reasons: List of messages explaining each failed check
+    """
+    h, w = frame.shape[:2]
+    scores = {"face_count": len(faces)}
+
+    if len(faces) == 0:
+        return False, scores, ["No face detected. Look straight at the camera."]
+    if len(faces) > 1:
+        return False, scores, ["More than one face detected. Make sure only you are in view."]
+
+    x, y, fw, fh = faces[0]
+    scores["face_ratio"] = fw / w
+    scores["face_offset"] = float(np.hypot((x + fw / 2) / w - 0.5, (y + fh / 2) / h - 0.5))
+
+    # Sharpness and exposure are measured on the face itself
+    scores.update(image_scores(frame[y:y + fh, x:x + fw]))
+    reasons = _image_reasons(scores, thresholds, "face")
+
+    if scores["face_ratio"] < thresholds.min_face_ratio:
+        reasons.append("Face is too small. Move closer to the camera.")
+    if scores["face_offset"] > thresholds.max_face_offset:
+        reasons.append("Center your face in the frame.")
+
+    return not reasons, scores, reasons
+
+
+class CaptureStats:
+    """
+    Process-wide counters for measuring model calls per successful verification
+
+    Safe to share between Streamlit sessions (threads).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.model_calls = 0
+        self.verifications = 0
+        self.rejections = Counter()
+
+    def add_model_call(self):
+        with self._lock:
+            self.model_calls += 1
+
+    def add_verification(self):
+        with self._lock:
+            self.verifications += 1
+
+    def add_rejection(self, reasons):
+        with self._lock:
+            self.rejections.update(reasons)
+
+    @property
+    def calls_per_verification(self):
+        """Model calls per completed verification, None before the first one"""
+        with self._lock:
+            if not self.verifications:
+                return None
+            return self.model_calls / self.verifications
+
+
+def evaluate_recording(path, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Run the gate over a frame recording (see frame_recording.py)
+
+    Document frames are rectified with their recorded corners first; face frames
+    are scored with their recorded face boxes.
+
+    Returns:
+        report: Dict per source with frames scored, frames passed and a Counter of reasons
+    """
+    from document_detection import extract_document
+    from frame_recording import Recording
+
+    recording = Recording(path)
+    report = {}
+
+    for entry in recording.entries:
+        frame = recording.frame(entry)
+        if entry["source"] == "document":
+            coords = entry["result"]["coords"]
+            if coords is None:
+                continue
+            document = extract_document(frame, np.array(coords, dtype=np.float32))
+            passed, _, reasons = score_document(document, thresholds)
+        else:
+            passed, _, reasons = score_face(frame, entry["result"]["faces"], thresholds)
+
+        source = report.setdefault(entry["source"], {"scored": 0, "passed": 0, "reasons": Counter()})
+        source["scored"] += 1
+        source["passed"] += passed
+        source["reasons"].update(reasons)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the capture-quality gate over a frame recording")
+    parser.add_argument("recording", help="Recording directory written with ID_SCANNER_RECORD_DIR")
+    args = parser.parse_args()
+
+    report = evaluate_recording(args.recording)
+    for name, source in sorted(report.items()):
+        rejected = source["scored"] - source["passed"]
+        print(f"{name}: {source['scored']} frames scored, {rejected} rejected ({rejected / source['scored']:.0%})")
+        for reason, count in source["reasons"].most_common():
+            print(f"  {count:>6}  {reason}")
+
+    # A rejected frame delays the capture to a later frame rather than saving a call
+    print("\nRejected frames are not model calls saved. To measure calls per verification with and without "
+          "the gate, run load_test.py with and without --no-quality-gate.")
+
+
+if __name__ == "__main__":
+    main()
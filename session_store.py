@@ -0,0 +1,364 @@
+"""
+External session-state storage
+
+Keeps the verification flow state (page, extracted data, verification result)
+and references to the captured images outside the Streamlit process, so that
+several app processes can serve the same sessions behind a load balancer and a
+restarted process can resume in-flight verifications.
+
+Stores are opened from a URL:
+    sqlite:///sessions.db           shared by all processes on one host (sqlite:////abs/path.db)
+    redis://host:6379/0             shared across hosts (needs the redis package)
+    local://                        in-process stand-in for a Redis server
+
+State is serialised as compact JSON; images are JPEG encoded, stored under a
+key of their session and content hash, and only loaded when a page needs them.
+Images are not shared between sessions, so deleting one never affects another
+session that captured the same bytes.
+
+The sid in the URL only names a session. A stored session is resumed only by
+the browser that created it, identified by a hash of one of its cookies (see
+session_owner), so a leaked URL does not expose the session.
+
+Usage:
+    ID_SCANNER_SESSION_STORE=sqlite:////var/lib/id-scanner/sessions.db streamlit run app.py
+    python session_store.py sqlite:////tmp/sessions.db --processes 1 2 4 8
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import sqlite3
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+# Sessions and images not written for this long are removed
+DEFAULT_TTL = 24 * 60 * 60
+
+IMAGE_QUALITY = 95
+
+
+def encode_state(state):
+    """Serialise a flow state dict to compact JSON bytes"""
+    return json.dumps(state, separators=(",", ":")).encode("utf-8")
+
+
+def decode_state(data):
+    """Inverse of encode_state"""
+    return json.loads(data)
+
+
+def session_owner(cookie_value):
+    """
+    Identify the browser a session belongs to
+
+    Streamlit re-masks its XSRF cookie ("2|mask|masked token|timestamp") on every
+    page load; the token underneath is stable, so it is unmasked first. Other
+    cookies are used as they are.
+
+    Args:
+        cookie_value: Value of the browser's session cookie
+
+    Returns:
+        owner: Hex digest stored with the session, never the cookie itself
+    """
+    token = cookie_value.encode("utf-8")
+    parts = cookie_value.split("|")
+    if len(parts) == 4 and parts[0] == "2":
+        try:
+            mask, masked = bytes.fromhex(parts[1]), bytes.fromhex(parts[2])
+            token = bytes(b ^ mask[i % len(mask)] for i, b in enumerate(masked))
+        except (ValueError, ZeroDivisionError):
+            pass
+    return hashlib.sha256(b"id-scanner-session-owner:" + token).hexdigest()
+
+
+def encode_image(image, session_id):
+    """
+    Encode an image for storage
+
+    Args:
+        image: BGR image (numpy array)
+        session_id: Session the image belongs to
+
+    Returns:
+        ref: Image reference, the session id and the content hash
+        data: JPEG bytes
+    """
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, IMAGE_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode image")
+    data = buffer.tobytes()
+    return f"{session_id}:{hashlib.sha1(data).hexdigest()}", data
+
+
+def decode_image(data):
+    """Inverse of encode_image"""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+class SQLiteSessionStore:
+    """
+    Session store in a SQLite database shared by the processes on one host
+
+    Args:
+        path: Database file
+        ttl: Seconds after which an untouched session or image is removed
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+
+        db = self._db()
+        db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state BLOB, updated REAL)")
+        db.execute("CREATE TABLE IF NOT EXISTS images (ref TEXT PRIMARY KEY, data BLOB, updated REAL)")
+        db.commit()
+
+    def _db(self):
+        """One connection per thread; WAL lets readers and a writer work concurrently"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def load(self, session_id):
+        """Return the stored state of a session, or None"""
+        row = self._db().execute("SELECT state, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return decode_state(row[0])
+
+    def save(self, session_id, state, images=()):
+        """Store the state of a session and keep the images it references alive as long"""
+        now = time.time()
+        db = self._db()
+        with db:
+            db.execute("INSERT OR REPLACE INTO sessions (id, state, updated) VALUES (?, ?, ?)",
+                       (session_id, encode_state(state), now))
+            db.executemany("UPDATE images SET updated = ? WHERE ref = ?", [(now, ref) for ref in images])
+        self._expire()
+
+    def delete(self, session_id):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def put_image(self, image, session_id):
+        """Store an image of a session and return its reference"""
+        ref, data = encode_image(image, session_id)
+        db = self._db()
+        with db:
+            db.execute("INSERT OR REPLACE INTO images (ref, data, updated) VALUES (?, ?, ?)",
+                       (ref, data, time.time()))
+        return ref
+
+    def get_image(self, ref):
+        """Return a stored image, or None if it no longer exists"""
+        row = self._db().execute("SELECT data FROM images WHERE ref = ?", (ref,)).fetchone()
+        return decode_image(row[0]) if row else None
+
+    def delete_image(self, ref):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM images WHERE ref = ?", (ref,))
+
+    def _expire(self):
+        """Remove expired sessions and images every few hundred writes"""
+        self._writes += 1
+        if self._writes % 500:
+            return
+        cutoff = time.time() - self.ttl
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,))
+            db.execute("DELETE FROM images WHERE updated < ?", (cutoff,))
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the subset of the Redis client API used by RedisSessionStore
+
+    Lets the Redis backend run without a server, e.g. in a single process.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            value, expires = self._data.get(name, (None, None))
+            if expires is not None and expires < time.time():
+                del self._data[name]
+                return None
+            return value
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def expire(self, name, time_seconds):
+        with self._lock:
+            if name not in self._data:
+                return False
+            self._data[name] = (self._data[name][0], time.time() + time_seconds)
+            return True
+
+
+class RedisSessionStore:
+    """
+    Session store in a Redis server (or LocalRedis)
+
+    Args:
+        client: redis.Redis or LocalRedis instance
+        prefix: Key prefix
+        ttl: Seconds after which an untouched session or image expires
+    """
+
+    def __init__(self, client, prefix="id-scanner", ttl=DEFAULT_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def load(self, session_id):
+        """Return the stored state of a session, or None"""
+        data = self.client.get(f"{self.prefix}:session:{session_id}")
+        return decode_state(data) if data is not None else None
+
+    def save(self, session_id, state, images=()):
+        """Store the state of a session and keep the images it references alive as long"""
+        self.client.set(f"{self.prefix}:session:{session_id}", encode_state(state), ex=self.ttl)
+        for ref in images:
+            self.client.expire(f"{self.prefix}:image:{ref}", self.ttl)
+
+    def delete(self, session_id):
+        self.client.delete(f"{self.prefix}:session:{session_id}")
+
+    def put_image(self, image, session_id):
+        """Store an image of a session and return its reference"""
+        ref, data = encode_image(image, session_id)
+        self.client.set(f"{self.prefix}:image:{ref}", data, ex=self.ttl)
+        return ref
+
+    def get_image(self, ref):
+        """Return a stored image, or None if it no longer exists"""
+        data = self.client.get(f"{self.prefix}:image:{ref}")
+        return decode_image(data) if data is not None else None
+
+    def delete_image(self, ref):
+        self.client.delete(f"{self.prefix}:image:{ref}")
+
+
+def open_session_store(url, ttl=DEFAULT_TTL):
+    """
+    Open a session store from a URL (see module docstring)
+
+    Returns:
+        store: SQLiteSessionStore or RedisSessionStore
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], ttl=ttl)
+
+    if url.startswith("local://"):
+        return RedisSessionStore(LocalRedis(), ttl=ttl)
+
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis package is required for redis:// session stores: pip install redis")
+        return RedisSessionStore(redis.Redis.from_url(url), ttl=ttl)
+
+    raise ValueError(f"Unsupported session store URL: {url}")
+
+
+def _bench_worker(url, duration, image, counter):
+    """Walk sessions through the flow for `duration` seconds, counting store operations"""
+    store = open_session_store(url)
+    operations = 0
+    deadline = time.time() + duration
+
+    while time.time() < deadline:
+        session_id = uuid.uuid4().hex
+        state = {"page": "id_scan", "id_data": None, "id_image": None, "verification_result": None,
+                 "verification_id": None}
+        store.save(session_id, state)
+
+        state["page"] = "show_data"
+        state["id_data"] = json.dumps({"document_type": "ID Card", "id_number": session_id[:10],
+                                       "full_name": "Test Person"}, indent=2)
+        state["id_image"] = store.put_image(image, session_id)
+        store.save(session_id, state, images=[state["id_image"]])
+
+        # A different process picks the session up and needs the image
+        restored = store.load(session_id)
+        store.get_image(restored["id_image"])
+
+        restored["page"] = "result"
+        restored["verification_result"] = json.dumps({"same_person": True, "confidence_score": 90})
+        store.save(session_id, restored)
+        operations += 6
+
+    with counter.get_lock():
+        counter.value += operations
+
+
+def bench(url, processes, duration=5.0):
+    """
+    Measure aggregate store throughput with several processes
+
+    Returns:
+        ops_per_second: Store operations per second across all processes
+    """
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, size=(340, 540, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (9, 9), 0)
+
+    context = multiprocessing.get_context("spawn")
+    counter = context.Value("q", 0)
+    workers = [context.Process(target=_bench_worker, args=(url, duration, image, counter))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return counter.value / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate throughput of a session store")
+    parser.add_argument("url", help="Session store URL (sqlite:///... or redis://...)")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per measurement")
+    args = parser.parse_args()
+
+    if args.url.startswith("local://"):
+        parser.error("local:// stores cannot be shared between processes")
+
+    # Create the schema once before the workers start
+    open_session_store(args.url)
+
+    print(f"{'processes':>9} {'ops/s':>10} {'flows/s':>9}")
+    for processes in args.processes:
+        ops = bench(args.url, processes, args.duration)
+        print(f"{processes:>9} {ops:>10.0f} {ops / 6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
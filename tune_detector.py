@@ -0,0 +1,318 @@
+"""
+Auto-tuner for the document detector parameters
+
+Searches the DetectorProfile parameter space against a labeled or synthetic
+image set and reports the Pareto front of per-frame latency against detection
+rate, corner error and false positive rate.
+
+Usage:
+    python tune_detector.py --synthetic 200 --trials 150
+    python tune_detector.py --labels captures/ --trials 300 --save profile.json --max-latency-ms 8
+
+A labeled set is a directory of images plus a labels.json file mapping each file
+name to its four document corners in pixels ([[x, y], ...]) or to null when the
+image contains no document. The chosen profile is used by the app when
+ID_SCANNER_DETECTOR_PROFILE points to the saved file.
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+
+from document_detection import DEFAULT_PROFILE, DetectorProfile, find_document_contour, order_points
+
+# Candidate values per parameter; the search samples profiles from this grid
+SEARCH_SPACE = {
+    "blur_kernel": [3, 5, 7, 9],
+    "canny_low": [25, 50, 75, 100],
+    "canny_high": [100, 150, 200, 250],
+    "max_contours": [1, 3, 5, 10],
+    "epsilon_ratio": [0.01, 0.02, 0.03, 0.05],
+    "min_area_ratio": [0.03, 0.05, 0.1],
+    "max_area_ratio": [0.8, 0.9, 0.95],
+    "fallbacks": [(), ("morph_close",), ("adaptive",), ("morph_close", "adaptive")],
+    "close_kernel": [5, 7, 11],
+    "adaptive_block_size": [11, 21, 31],
+    "adaptive_c": [5, 10, 15],
+}
+
+
+def make_synthetic_set(count, seed=0, size=(480, 640)):
+    """
+    Generate labeled frames with a card in random perspective
+
+    Frames vary in background texture and contrast, lighting gradient, blur,
+    noise and glare; about one in ten contains no document.
+
+    Args:
+        count: Number of frames
+        seed: Random seed
+        size: Frame (height, width)
+
+    Returns:
+        samples: List of (frame, corners) tuples, corners is a 4x2 array or None
+    """
+    rng = np.random.default_rng(seed)
+    h, w = size
+    samples = []
+
+    for _ in range(count):
+        base = rng.integers(20, 160)
+        frame = rng.normal(base, rng.uniform(3, 25), size=(h, w, 3)).clip(0, 255).astype(np.uint8)
+
+        corners = None
+        if rng.random() > 0.1:
+            card_w = rng.uniform(0.35, 0.7) * w
+            card_h = card_w / 1.586  # ID-1 card aspect ratio
+            cx = rng.uniform(card_w / 2 + 10, w - card_w / 2 - 10)
+            cy = rng.uniform(card_h / 2 + 10, h - card_h / 2 - 10)
+            corners = np.array([[-card_w / 2, -card_h / 2], [card_w / 2, -card_h / 2],
+                                [card_w / 2, card_h / 2], [-card_w / 2, card_h / 2]])
+            corners += rng.normal(0, 0.04 * card_w, size=(4, 2))
+            angle = np.deg2rad(rng.uniform(-15, 15))
+            rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+            corners = corners @ rotation.T + [cx, cy]
+
+            card_value = int(np.clip(base + rng.choice([-1, 1]) * rng.uniform(30, 120), 0, 255))
+            cv2.fillPoly(frame, [corners.astype(np.int32)], (card_value,) * 3, lineType=cv2.LINE_AA)
+
+            # Glare spot on the laminate
+            if rng.random() < 0.3:
+                center = corners.mean(axis=0) + rng.normal(0, 0.2 * card_h, size=2)
+                cv2.circle(frame, tuple(int(v) for v in center), int(rng.uniform(0.1, 0.3) * card_h),
+                           (255, 255, 255), -1, lineType=cv2.LINE_AA)
+
+        # Uneven lighting, camera blur and sensor noise
+        gradient = np.linspace(rng.uniform(0.6, 1.0), rng.uniform(1.0, 1.4), w)[None, :, None]
+        frame = (frame * gradient).clip(0, 255).astype(np.uint8)
+        k = int(rng.choice([1, 3, 5, 7]))
+        if k > 1:
+            frame = cv2.GaussianBlur(frame, (k, k), 0)
+        frame = (frame + rng.normal(0, rng.uniform(0, 8), size=frame.shape)).clip(0, 255).astype(np.uint8)
+
+        samples.append((frame, corners))
+
+    return samples
+
+
+def load_labeled_set(directory):
+    """
+    Load a labeled image set
+
+    Args:
+        directory: Directory with images and labels.json
+
+    Returns:
+        samples: List of (frame, corners) tuples, corners is a 4x2 array or None
+    """
+    with open(os.path.join(directory, "labels.json"), "r") as f:
+        labels = json.load(f)
+
+    samples = []
+    for name, corners in sorted(labels.items()):
+        frame = cv2.imread(os.path.join(directory, name))
+        if frame is None:
+            raise ValueError(f"Could not read {name}")
+        samples.append((frame, None if corners is None else np.array(corners, dtype=np.float32)))
+    return samples
+
+
+def evaluate(profile, samples, repeats=1):
+    """
+    Measure a profile on an image set
+
+    Args:
+        profile: DetectorProfile
+        samples: List of (frame, corners) tuples
+        repeats: Timing repetitions per frame (the minimum is used)
+
+    Returns:
+        result: Dict with latency_ms, p95_ms, detection_rate, false_positive_rate and corner_error
+            (mean corner distance as a fraction of the frame diagonal, None if nothing was detected)
+    """
+    latencies = []
+    positives = detected = negatives = false_positives = 0
+    errors = []
+
+    for frame, corners in samples:
+        best = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            coords, _ = find_document_contour(frame, profile)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        latencies.append(best * 1000)
+
+        if corners is None:
+            negatives += 1
+            false_positives += coords is not None
+            continue
+
+        positives += 1
+        if coords is not None:
+            detected += 1
+            predicted = order_points(coords.reshape(4, 2).astype(np.float32))
+            expected = order_points(np.asarray(corners, dtype=np.float32))
+            diagonal = np.hypot(*frame.shape[:2])
+            errors.append(float(np.linalg.norm(predicted - expected, axis=1).mean() / diagonal))
+
+    return {
+        "latency_ms": float(np.mean(latencies)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "detection_rate": detected / positives if positives else 0.0,
+        "false_positive_rate": false_positives / negatives if negatives else 0.0,
+        "corner_error": float(np.mean(errors)) if errors else None,
+    }
+
+
+def sample_profiles(trials, seed=0):
+    """
+    Sample distinct profiles from SEARCH_SPACE; the default profile is always included
+
+    Returns:
+        profiles: List of DetectorProfile
+    """
+    rng = random.Random(seed)
+    profiles = [DEFAULT_PROFILE]
+    seen = {json.dumps(DEFAULT_PROFILE.to_dict(), sort_keys=True)}
+
+    for _ in range(trials * 20):
+        if len(profiles) >= trials:
+            break
+        values = {name: rng.choice(options) for name, options in SEARCH_SPACE.items()}
+        if values["canny_low"] >= values["canny_high"] or values["min_area_ratio"] >= values["max_area_ratio"]:
+            continue
+        # Parameters of strategies that are not used do not change the result
+        if "morph_close" not in values["fallbacks"]:
+            values["close_kernel"] = DEFAULT_PROFILE.close_kernel
+        if "adaptive" not in values["fallbacks"]:
+            values["adaptive_block_size"] = DEFAULT_PROFILE.adaptive_block_size
+            values["adaptive_c"] = DEFAULT_PROFILE.adaptive_c
+        profile = DetectorProfile(**values)
+        key = json.dumps(profile.to_dict(), sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            profiles.append(profile)
+
+    return profiles
+
+
+def _objectives(result):
+    """Objectives to minimise: latency, missed detections, corner error, false positives"""
+    error = result["corner_error"] if result["corner_error"] is not None else float("inf")
+    return result["latency_ms"], -result["detection_rate"], error, result["false_positive_rate"]
+
+
+def pareto_front(results):
+    """
+    Return the results that are not dominated by any other result
+
+    Args:
+        results: List of (profile, result) tuples from evaluate
+
+    Returns:
+        front: Non-dominated (profile, result) tuples sorted by latency
+    """
+    objectives = [_objectives(result) for _, result in results]
+    front = []
+    for i, item in enumerate(results):
+        dominated = any(
+            all(a <= b for a, b in zip(other, objectives[i])) and other != objectives[i]
+            for j, other in enumerate(objectives) if j != i
+        )
+        if not dominated:
+            front.append(item)
+    return sorted(front, key=lambda item: item[1]["latency_ms"])
+
+
+def choose_profile(front, max_latency_ms=None, max_false_positive_rate=None):
+    """
+    Pick the front entry with the best detection rate (then corner error) within a latency budget
+    and a false positive budget
+
+    Returns:
+        (profile, result) tuple or None if nothing fits the budgets
+    """
+    candidates = [
+        item for item in front
+        if (max_latency_ms is None or item[1]["latency_ms"] <= max_latency_ms)
+        and (max_false_positive_rate is None or item[1]["false_positive_rate"] <= max_false_positive_rate)
+    ]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda item: (-item[1]["detection_rate"], _objectives(item[1])[2],
+                                             item[1]["false_positive_rate"]))
+
+
+def format_front(front):
+    """Format the Pareto front as a plain text table"""
+    header = f"{'ms/frame':>9} {'p95 ms':>8} {'detect':>7} {'false+':>7} {'corner err':>10}  profile"
+    lines = [header, "-" * len(header)]
+    for profile, result in front:
+        error = f"{result['corner_error']:.4f}" if result["corner_error"] is not None else "-"
+        changed = {key: value for key, value in profile.to_dict().items()
+                   if value != DEFAULT_PROFILE.to_dict()[key]}
+        lines.append(f"{result['latency_ms']:>9.2f} {result['p95_ms']:>8.2f} {result['detection_rate']:>7.1%} "
+                     f"{result['false_positive_rate']:>7.1%} {error:>10}  "
+                     f"{json.dumps(changed) if changed else 'default'}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the document detector parameters")
+    parser.add_argument("--labels", help="Directory with images and labels.json")
+    parser.add_argument("--synthetic", type=int, default=200, help="Number of synthetic frames if --labels is not given")
+    parser.add_argument("--trials", type=int, default=100, help="Number of profiles to evaluate")
+    parser.add_argument("--repeats", type=int, default=1, help="Timing repetitions per frame")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the chosen profile to this JSON file")
+    parser.add_argument("--max-latency-ms", type=float, help="Latency budget when choosing the profile to save")
+    parser.add_argument("--max-false-positive-rate", type=float,
+                        help="False positive budget when choosing the profile to save "
+                             "(defaults to the rate of the default profile)")
+    args = parser.parse_args()
+
+    if args.labels:
+        samples = load_labeled_set(args.labels)
+    else:
+        samples = make_synthetic_set(args.synthetic, seed=args.seed)
+
+    # Measure single-threaded latency, as in one worker of the OpenCV pool
+    cv2.setNumThreads(1)
+
+    profiles = sample_profiles(args.trials, seed=args.seed)
+    results = []
+    for i, profile in enumerate(profiles, 1):
+        results.append((profile, evaluate(profile, samples, args.repeats)))
+        print(f"\rEvaluated {i}/{len(profiles)} profiles", end="", flush=True)
+    print("\n")
+
+    baseline = results[0][1]
+    print(f"Default profile: {baseline['latency_ms']:.2f} ms/frame, {baseline['detection_rate']:.1%} detected\n")
+    front = pareto_front(results)
+    print("Pareto front (latency vs detection rate vs corner error vs false positives):")
+    print(format_front(front))
+
+    if args.save:
+        max_false_positive_rate = args.max_false_positive_rate
+        if max_false_positive_rate is None:
+            max_false_positive_rate = baseline["false_positive_rate"]
+        chosen = choose_profile(front, args.max_latency_ms, max_false_positive_rate)
+        if chosen is None:
+            print(f"\nNo profile on the front fits {args.max_latency_ms} ms/frame and "
+                  f"{max_false_positive_rate:.1%} false positives; nothing saved")
+            return
+        with open(args.save, "w") as f:
+            json.dump(chosen[0].to_dict(), f, indent=2)
+        print(f"\nSaved profile ({chosen[1]['latency_ms']:.2f} ms/frame, "
+              f"{chosen[1]['detection_rate']:.1%} detected, {chosen[1]['false_positive_rate']:.1%} false positives) "
+              f"to {args.save}")
+
+
+if __name__ == "__main__":
+    main()